@@ -1,21 +1,35 @@
 from django.contrib import admin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from django.db.models import Count, F, Sum, Q
-from .models import Product, Order, OrderItem, DeliveryDate, Reciept
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from .models import Product, Order, OrderItem, DeliveryDate, Reciept, Broadcast, ProductSales, MismatchedPayment
+from .broadcast import delivery_date_message, start_broadcast_thread
+from .manifest import astream, manifest_lines
+from . import notifications, order_details
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ["title", "price", "payed_quantity"]
+    list_display = ["title", "price", "payed_quantity", "revenue", "pending_quantity"]
 
-    def payed_quantity(self, order):
-        return order.payed_quantity
+    def payed_quantity(self, product):
+        return product.payed_quantity
+
+    def revenue(self, product):
+        return product.revenue
+
+    def pending_quantity(self, product):
+        return product.pending_quantity
 
     def get_queryset(self, request):
+        # read from the ProductSales table (kept up to date by bot/sales.py) rather than summing every order item
         return super().get_queryset(request).annotate(
-            payed_quantity = Sum(
-                "orderitem__quantity",
-                filter=Q(orderitem__order__payed=True)
-            )
+            payed_quantity=Coalesce(Sum("sales__paid_cartons"), 0),
+            revenue=Coalesce(Sum("sales__revenue"), 0),
+            pending_quantity=Coalesce(Sum("sales__pending_cartons"), 0),
         )
 
 
@@ -25,16 +39,66 @@ admin.site.register(Product, ProductAdmin)
 
 
 class OrderAdmin(admin.ModelAdmin):
-    exclude = ["payed"] # to exclude payed boolean value from list of fields admin can change
-    list_display = ["__str__", "delivered", "full_name", "hall", "room_no", "delivery_date", "payed"]
+    # to exclude payed boolean value and the paystack link from list of fields admin can change
+    exclude = ["payed", "payment_url", "payment_reference", "payment_amount", "payment_expires_at"]
+    readonly_fields = ["subtotal", "total"]
+    list_display = ["__str__", "delivered", "full_name", "hall", "room_no", "delivery_date", "total", "payed"]
     list_editable = ["delivered"]
     list_filter = ["payed", "delivered", "hall"]
+    actions = ["mark_delivered"]
+    change_list_template = "admin/bot/order/change_list.html"
+
+    def get_urls(self):
+        return [
+            path("manifest/", self.admin_site.admin_view(self.manifest_view), name="bot_order_manifest"),
+        ] + super().get_urls()
+
+    def manifest_view(self, request):
+        """
+        Downloads the delivery manifest of the current delivery date, streamed as it's read from the database.
+        """
+        lines = manifest_lines()
+        response = StreamingHttpResponse(
+            astream(lines) if isinstance(request, ASGIRequest) else lines,
+            content_type="text/plain; charset=utf-8",
+        )
+        response["Content-Disposition"] = 'attachment; filename="delivery-manifest.txt"'
+        return response
+
+    @admin.action(description="Mark selected orders as delivered and notify buyers")
+    def mark_delivered(self, request, queryset):
+        """
+        Flips every selected payed order to delivered in one UPDATE, then queues one message per buyer.
+        """
+        orders = queryset.filter(payed=True, delivered=False)
+
+        delivered_orders = {}  # user_id -> [(order id, hall)]
+        for user_id, order_id, hall in orders.values_list("user_id", "id", "hall").order_by("user_id", "id").iterator(chunk_size=2000):
+            delivered_orders.setdefault(user_id, []).append((order_id, hall))
+
+        updated = orders.update(delivered=True, updated_at=timezone.now())
+        order_details.invalidate(order_id for user_orders in delivered_orders.values() for order_id, hall in user_orders)
+
+        for user_id, user_orders in delivered_orders.items():
+            order_list = ", ".join(f"#{order_id} ({hall} Hall)" for order_id, hall in user_orders)
+            notifications.send_message(
+                user_id,
+                f"*📦 Delivered!* 🎉\nYour Indomie for order {order_list} has been delivered. Enjoy! 🍜😋",
+                parse_mode="Markdown",
+            )
+
+        skipped = queryset.count() - updated
+        self.message_user(
+            request,
+            f"{updated} orders marked as delivered and {len(delivered_orders)} buyers notified. "
+            f"{skipped} selected orders were unpayed or already delivered and left as they were.",
+        )
 
 admin.site.register(Order, OrderAdmin)
 
 
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ["order", "product__title", "quantity"]
+    list_display = ["order", "product__title", "quantity", "unit_price"]
 
 admin.site.register(OrderItem, OrderItemAdmin)
 
@@ -42,7 +106,15 @@ admin.site.register(OrderItem, OrderItemAdmin)
 class DeliveryDateAdmin(admin.ModelAdmin):
     list_display = ["__str__", "date", ]
     list_editable = ["date"]
-    
+    actions = ["notify_buyers"]
+
+    @admin.action(description="Notify buyers of the selected delivery date")
+    def notify_buyers(self, request, queryset):
+        delivery_date = queryset.order_by("-id").first()
+        broadcast = Broadcast.objects.create(message=delivery_date_message(delivery_date))
+        start_broadcast_thread(broadcast)
+        self.message_user(request, f"{broadcast} started, follow its progress under Broadcasts.")
+
 admin.site.register(DeliveryDate, DeliveryDateAdmin)
 
 
@@ -57,3 +129,31 @@ class RecieptAdmin(admin.ModelAdmin):
         return format_html("<span style='color: rgb(164, 235, 72);'>{}</span>", reciept.reference)
 
 admin.site.register(Reciept, RecieptAdmin)
+
+
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ["__str__", "created_at", "completed_at", "sent_count", "failed_count"]
+    readonly_fields = ["created_at", "completed_at", "last_user_id", "sent_count", "failed_count"]
+
+admin.site.register(Broadcast, BroadcastAdmin)
+
+
+class ProductSalesAdmin(admin.ModelAdmin):
+    list_display = ["product", "delivery_date", "paid_cartons", "revenue", "pending_cartons"]
+    list_filter = ["delivery_date"]
+    readonly_fields = ["product", "delivery_date", "paid_cartons", "revenue", "pending_cartons"]
+
+admin.site.register(ProductSales, ProductSalesAdmin)
+
+
+class MismatchedPaymentAdmin(admin.ModelAdmin):
+    list_display = ["reference", "order", "naira", "reason", "created_at", "resolved"]
+    list_editable = ["resolved"]
+    list_filter = ["resolved"]
+    readonly_fields = ["order", "reference", "amount", "reason", "charge", "created_at"]
+
+    @admin.display(description="Amount (₦)")
+    def naira(self, payment):
+        return payment.amount / 100
+
+admin.site.register(MismatchedPayment, MismatchedPaymentAdmin)
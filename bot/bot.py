@@ -1,24 +1,57 @@
+import logging
 import re
-import requests
 from urllib.parse import urlencode
 
-import telebot
 from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
-from bot.models import Product, Order, OrderItem, Reciept, DeliveryDate
+from bot.models import Product, Order, OrderItem, Reciept
+from bot.dispatch import DispatchingTeleBot
+from bot.outbox import Outbox
+from bot.state import get_state_store, get_step_backend
+from bot import cart, catalogue, payments, screens
+from bot.navigation import show_screen
+from bot.router import CallbackRouter, encode
+
+
+logger = logging.getLogger(__name__)
+
+# Initialize the bot with the token, updates are handled on a pool of worker threads
+# and, with the database state store, the steps of unfinished orders are kept in the database too
+bot = DispatchingTeleBot(
+    settings.TOKEN,
+    num_threads=settings.BOT_WORKER_THREADS,
+    next_step_backend=get_step_backend(),
+)
+
+# Messages are sent through the outbox so bursts stay within telegram's rate limits
+outbox = Outbox(
+    bot,
+    global_rate=settings.TELEGRAM_GLOBAL_RATE,
+    chat_rate=settings.TELEGRAM_CHAT_RATE,
+    chat_burst=settings.TELEGRAM_CHAT_BURST,
+)
+website_link = settings.WEBSITE_LINK
 
+# Every callback query is dispatched by this router, see the CALLBACK HANDLERS section
+router = CallbackRouter()
 
-# Initialize the bot with the token
-bot = telebot.TeleBot(settings.TOKEN)
-website_link = settings.WEBSITE_LINK
+# The start, help and hall screens are rendered once, handlers send them as they are
+screens.reload()
 
-# Dictionary to track user orders
-user_orders = {}
+# Tracks orders users are still filling in, entries expire after settings.BOT_STATE_TTL
+user_orders = get_state_store()
+
+# /payed messages are filled with orders up to this many characters, telegram rejects messages over 4096
+PAYED_PAGE_MAX_LENGTH = 4000
+# Most orders loaded for one /payed message, small orders stop a page here before it gets that long
+PAYED_ORDERS_PER_PAGE = 10
 
 # Common error messages
+empty_cart = "🛒 *Your cart is empty!* 😢 \nLooks like you haven’t added any cartons of Indomie yet. Select your favorite carton(s) and let’s get the party started! 🍜🔥"
 no_active_order = "🚫 *No active order found!* 😢 Looks like you left for a long time.\
 🛒 _No worries!_ Start fresh by adding a product to your cart again. Head back and select your favorite Indomie pack! 🍜🔥"
 
@@ -30,38 +63,23 @@ def start(message):
     """
     Handles the /list command. Displays a menu with options for the user.
     """
-    markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Products", callback_data="products"))
-    markup.add(InlineKeyboardButton("Help", callback_data="help"))
-    msg = """
-🌟 Hey there! I’m the *CU Indomie Guy!* 🎉
-*----------------------------------------------------------------------*
-
-I’m here to make your _Indomie_ cravings super easy to satisfy! 🛒
-Whether it’s a carton (or more 👀), I’ll hook you up with premium-quality _Indomie_ straight from our trusted vendor.
-
-🚚 Delivery? No stress! Your order will land at your hall 🏠 within *7 days* max—guaranteed.
-
-👇 Tap one of the options below to see what magic we can cook up together! 🔥"""
-    bot.send_message(message.chat.id, 
-        msg, 
+    screen = screens.get_screen("start")
+    outbox.send_message(message.chat.id, 
+        screen["msg"], 
         parse_mode="Markdown", 
-        reply_markup=markup)
+        reply_markup=screen["markup"])
 
 
 # /products command handler - List products
 @bot.message_handler(commands=["products"])
-def products(message):
+def products(message, edit=False):
     """
-    Lists all available products retrieved from the database.
+    Lists all available products from the cached catalogue.
     """
-    markup = InlineKeyboardMarkup()
-    for product in Product.objects.all():
-        markup.add(InlineKeyboardButton(f"{product.title}", callback_data=f"product_{product.id}"))
-    bot.send_message(message.chat.id, 
+    show_screen(message, 
         "🔥 *Time to stock up on Indomie!* 🍜 \nChoose your favorite pack below and let's get cooking: 😋👇",
-        parse_mode="Markdown", 
-        reply_markup=markup)
+        catalogue.product_list_markup(),
+        edit=edit)
 
 
 # /help command handler
@@ -71,34 +89,13 @@ def help_command(message, edit=False):
     Provides help information about the bot with a progressive view.
     """
     # Short initial text with a "Continue Reading" button
+    screen = screens.get_screen("help")
 
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(message)
 
-    msg = (
-        "*Help Section*\n"
-        "*----------------------------------------------------------------------*\n"
-        "👋 Hello, welcome to the help section! I'm here to guide you on how to use this bot to satisfy your Indomie cravings 🍜.\n"
-        "Click the button below to learn more about what I can do for you: 👇"
-    )
-    
-    # Create an inline keyboard with a "Continue Reading" button
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("📖 Continue Reading", callback_data="help_intro"))
-
-    # Send the short initial text
-    if edit:
-        bot.edit_message_text(
-            msg,
-            chat_id=message.chat.id,
-            message_id=message.message_id, 
-            parse_mode="Markdown", 
-            reply_markup=keyboard)
-    else:
-        bot.send_message(message.chat.id, 
-            msg, 
-            parse_mode="Markdown", 
-            reply_markup=keyboard)
+    # Send the short initial text, or show it in place of the message that was tapped
+    show_screen(message, screen["msg"], screen["markup"], edit=edit)
 
 
 
@@ -106,41 +103,12 @@ def help_command(message, edit=False):
 @bot.message_handler(commands=["cart"])
 def view_cart(message):
     """
-    Displays the user's cart with options to checkout, remove orders, or clear the cart.
+    Displays the user's cart with options to checkout, remove an item, or clear the cart.
     """
-    user_id = message.from_user.id
-    orders = Order.objects.filter(user_id=user_id, payed=False)
-
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(message)
 
-    if orders.exists():
-        msg = "*Hi, Here's your Cart items 🛒:*\n..................☆*: .｡. o(≧▽≦)o .｡.:*☆.....................\n\n"
-        markup = InlineKeyboardMarkup()
-
-        # List all unpayed orders
-        for order in orders:
-            items = OrderItem.objects.filter(order=order)
-            order_details = ""
-            for item in items:
-                order_details += f"🍜 *{item.product.title}* x {item.quantity} - (₦{item.product.price * item.quantity}) \n*📅 Delivery date:* {order.delivery_date}\n*✅ Delivered:* {order.delivered}\n\n"
-            msg += f"*Order id: #{order.id}* 🛒: \n{order_details}\n\n"
-
-        # Add buttons for checkout and remove
-        checkout_single = InlineKeyboardButton("Checkout an Order", callback_data="checkout_single_order")
-        remove_from_cart = InlineKeyboardButton("Remove an Order from Cart", callback_data="remove_order_cart")
-
-        # Add buttons to the markup
-        markup.add(checkout_single, remove_from_cart)
-
-        bot.send_message(message.chat.id, 
-            msg, 
-            parse_mode="Markdown", 
-            reply_markup=markup)
-    else:
-        bot.send_message(message.chat.id, 
-        "🛒 *Your cart is empty!* 😢 \nLooks like you haven’t added any cartons of Indomie yet. Select your favorite carton(s) and let’s get the party started! 🍜🔥",
-        parse_mode="Markdown")
+    send_cart(message, message.from_user.id)
 
 
 
@@ -151,33 +119,10 @@ def view_payed_orders(message):
     """
     Displays the users payed orders and their delivery status
     """
-    user_id = message.from_user.id
-    orders = Order.objects.filter(user_id=user_id, payed=True)
-
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(message)
 
-
-    if orders.exists():
-        msg = "*Your Checked Out Orders* 🎉\n✨ Your Indomie is on its way! 🚀🍜\n\n"
-
-        for order in orders:
-            items = OrderItem.objects.filter(order=order).select_related("product")
-            receipt = Reciept.objects.get(order=order)
-            delivery_url = website_link + reverse("paystack_callback") + f"?order_id={receipt.order.id}&trxref={receipt.trxref}&reference={receipt.reference}"
-            order_details = ""
-            for item in items:
-                order_details += f"🍜 *{item.product.title}* x {item.quantity} - (₦{item.product.price * item.quantity}) \n*📅 Delivery date:* {order.delivery_date}\n*✅ Delivered:* {order.delivered}\n\n"
-
-            msg += f"*Order id: #{order.id}* 🛒: \n[🎫 Click here to see receipt]({delivery_url}) \n{order_details}\n\n"
-        print(msg)
-        bot.send_message(message.chat.id, 
-            msg, 
-            parse_mode="Markdown")
-    else:
-        bot.send_message(message.chat.id, 
-                     "*You haven't checked out any orders yet*. 😕\nUse /cart to view unpayed orders 🛒\nUse /checkout to checkout an order 💳\nUse /products to view available products 🍜",
-                     parse_mode="Markdown")
+    send_payed_orders_page(message.chat.id, message.from_user.id)
 
 
 
@@ -185,24 +130,34 @@ def view_payed_orders(message):
 # /checkout command handler
 @bot.message_handler(commands=["checkout"])
 def checkout_command_handler(message):
-    checkout_single_order_command(message, is_callback=False)
+    checkout_cart_command(message, is_callback=False)
 
 
 #  ======================= CALLBACK HANDLERS =======================
 
-# Handle callback queries (button clicks)
-@bot.callback_query_handler(func=lambda call: call.data.startswith("order_"))
-def handle_order_callback(call):
+# Every callback query goes through the router, handlers are registered on it with the types of their arguments
+@bot.callback_query_handler(func=lambda call: True)
+def route_callback(call):
     """
-    Handles all callback queries from inline buttons.
+    Dispatches a callback query to its route, malformed or unknown data is only acknowledged.
+    """
+    if not router.dispatch(call):
+        bot.answer_callback_query(call.id)
+
+
+
+# Handle the "Add to Cart" button of a product
+@router.route("order", int)
+def handle_order_callback(call, product_id):
+    """
+    Starts adding a product to the cart by asking for the quantity.
     """
 
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
 
-    product_id = int(call.data.split("_")[1])
-    user_orders[call.from_user.id] = {"product_id": product_id, "quantity": None, "hall": None, "room_no": None}
-    bot.send_message(call.message.chat.id, 
+    user_orders.set(call.from_user.id, {"product_id": product_id, "quantity": None, "hall": None, "room_no": None})
+    outbox.send_message(call.message.chat.id, 
         "*📦 How many cartons of _Indomie_ do you want?* \n😋 Enter a number (e.g., 5) to place your order: 🔢👇",
         parse_mode="Markdown")
     bot.register_next_step_handler(call.message, get_quantity)
@@ -212,8 +167,8 @@ def handle_order_callback(call):
 
 
 # Callback query handler for progressive reading
-@bot.callback_query_handler(func=lambda call: call.data.startswith("help_"))
-def help_callback(call):
+@router.route("help_page", str)
+def help_callback(call, page):
     """
     Handles progressive text display for the help command.
     """
@@ -221,191 +176,138 @@ def help_callback(call):
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
 
-    if call.data == "help_edit":
+    if page == "edit":
         help_command(call.message, edit=True)
 
-    elif call.data == "help_intro":
-        # Detailed introduction text
-        intro_msg = (
-            "**#Intro**\n\n"
-            "So you're wondering what I'm about, right? 🤔\n\n"
-            "Simple! I'm a bot for ordering *Indomie* 🍜 from the convenience of your room. 🏠\n\n"
-            "All you have to do is place your order, and I'll forward it to my team to deliver straight to your hall within **7 days**. 🚀\n\n"
-            "Oh, and my name is **CU Indomie Guy**, just in case you missed it. 😊\n\n"
-            "Ready to see the commands? Tap below! 👇"
-        )
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("🔙 Back", callback_data="help_edit"),
-                     InlineKeyboardButton("📜 View Commands", callback_data="help_commands"),)
-        bot.edit_message_text(
-            intro_msg, 
-            chat_id=call.message.chat.id, 
-            message_id=call.message.message_id, 
-            parse_mode="Markdown", 
-            reply_markup=keyboard
-        )
-    
-    elif call.data == "help_commands":
-        # Commands list
-        commands_msg = (
-            "*#Commands*\n\n"
-            "/start - 🍜 Hello! I'm CU Indomie Guy 😎 — Your one-stop shop for tasty Indomie!\n"
-            "/help - 🤔 Confused? No worries, click here to find out how I can help you!\n"
-            "/products - 🍴 Explore all the delicious Indomie options available.\n"
-            "/cart - 🛒 View your cart and ensure you're ready to munch.\n"
-            "/checkout - 💳 Settle up and get your orders delivered.\n"
-            "/payed - 💰 Check all your paid and confirmed orders.\n"
-            "Want to know how to place an order? Tap below! 👇"
-        )
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("🔙 Back", callback_data="help_intro"),
-                     InlineKeyboardButton("📦 How to Place an Order", callback_data="help_how_to_order"))
-        bot.edit_message_text(
-            commands_msg, 
-            chat_id=call.message.chat.id, 
-            message_id=call.message.message_id, 
-            parse_mode="Markdown", 
-            reply_markup=keyboard
-        )
-    
-    elif call.data == "help_how_to_order":
-        # Step-by-step order instructions
-        order_msg = (
-            "**#How to Place an Order**\n\n"
-            "Here's how you can place an order in **7 easy steps**: 🛒\n\n"
-            "1️⃣ Click on /products and select a product.\n"
-            "2️⃣ Click on 'Add to Cart'. 🛍️\n"
-            "3️⃣ Enter the number of cartons you need (e.g., 1, 5). 🔢\n"
-            "4️⃣ Enter your email (e.g., `youremail@example.com`). 📧\n"
-            "5️⃣ Enter the full name of the recipient. 👤\n"
-            "6️⃣ Choose the recipient's hall (e.g., Paul Hall). 🏢\n"
-            "7️⃣ Enter the room number (e.g., A204). 🚪\n\n"
-            "Use /cart to view your cart and proceed to checkout. Easy, right? 😉"
-        )
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("🔙 Back", callback_data="help_commands"),)
-        bot.edit_message_text(
-            order_msg, 
-            chat_id=call.message.chat.id, 
-            message_id=call.message.message_id, 
-            parse_mode="Markdown",
-            reply_markup=keyboard
-        )
+    elif page in ("intro", "commands", "how_to_order"):
+        # Detailed introduction, commands list and step-by-step order instructions
+        screen = screens.get_screen(f"help_{page}")
+        show_screen(call.message, screen["msg"], screen["markup"], edit=True)
+
+    bot.answer_callback_query(call.id)
 
 
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("hall_"))
-def handle_hall_selection(call):
+@router.route("hall", str)
+def handle_hall_selection(call, hall):
     """
     Handles hall selection callback.
     """
     user_id = call.from_user.id
-    if user_id in user_orders:
-        hall = call.data.split("_")[1]  # Extract hall name from callback data
-        user_orders[user_id]["hall"] = hall
+    order_data = user_orders.get(user_id)
+    if not screens.is_hall(hall):
+        # a hall that has since been removed from settings.BOT_HALLS, or made up data
+        bot.answer_callback_query(call.id)
+        screen = screens.get_screen("halls")
+        outbox.send_message(call.message.chat.id, 
+            "*⚠️ We don't deliver to that hall.* 😕 \nPlease select one of these halls: 👇", 
+            reply_markup=screen["markup"], 
+            parse_mode="Markdown")
+    elif order_data:
+        order_data["hall"] = hall
+        user_orders.set(user_id, order_data)
         
         bot.answer_callback_query(call.id)
         new_msg = f"🏠 Looks like you're in *{hall} Hall!* Awesome! \n\n🎉 Now, drop your room number below so we know exactly where to deliver your carton of _Indomie_! (e.g., *A204*, *B108*) 🍜🚀"
         # Ask for room number
-        msg = bot.send_message(call.message.chat.id, 
+        outbox.send_message(call.message.chat.id, 
             new_msg, 
             parse_mode="Markdown")
-        bot.register_next_step_handler(msg, get_room_no)
+        bot.register_next_step_handler(call.message, get_room_no)
     else:
-        # Debug: User order not found
-        print(f"User {user_id} has no active order.")
-        
+        logger.info("User %s picked a hall without an active order", user_id)
         bot.answer_callback_query(call.id)
-        # Debug: User order not found
-        print(f"User {user_id} has no active order.")
-        bot.send_message(call.message.chat.id, 
+        outbox.send_message(call.message.chat.id, 
             no_active_order,
             parse_mode="Markdown")
 
 
 
 
-@bot.callback_query_handler(func= lambda call: call.data.startswith("product_"))
-def get_product(call):
+@router.route("product", int)
+def get_product(call, product_id):
     """
-    Retrieves product details based on the callback data.
+    Shows a product's details from the cached catalogue based on the callback data.
     """
-    product_id = call.data.split("_")[1]
-
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
 
-    try:
-        product = Product.objects.get(id=product_id)
-        msg = f"*📦 {product.title}* - 💰 ₦{product.price} 🍜\n📝 {product.description}"
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("Add to Cart 🛒", callback_data=f"order_{product.id}"))
-    except Product.DoesNotExist:
+    product = catalogue.get_product_detail(product_id)
+    if product:
+        msg = product["msg"]
+        markup = product["markup"]
+    else:
         msg = "*❌ Oops! This product seems to have vanished into thin air!* It's probably a problem from our end\n🚀💨 Try selecting another one. 🍜😉"
-        markup = None
-    bot.send_message(call.message.chat.id, 
-        msg, 
-        parse_mode="Markdown", 
-        reply_markup=markup)
+        markup = catalogue.product_list_markup()
+    # the product list turns into the product, its back button turns it back
+    show_screen(call.message, msg, markup, edit=True)
     bot.answer_callback_query(call.id)
 
 
 
 
-# Handle "Remove an order from cart" callback
-@bot.callback_query_handler(func=lambda call: call.data == "remove_order_cart")
-def handle_remove_order_cart(call):
+# Handle "Remove an item from cart" callback
+@router.route("remove_item_cart")
+def handle_remove_item_cart(call):
     """
-    Handles the removal of an entire order from the cart.
+    Lists the items in the user's cart to pick one to remove.
     """
     user_id = call.from_user.id
-    orders = Order.objects.filter(user_id=user_id, payed=False)
+    items = OrderItem.objects.filter(order__user_id=user_id, order__payed=False).select_related("product")
 
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
-    
-    if orders.exists():
-        # Create buttons for each order
+
+    if items:
+        # Create buttons for each item
         markup = InlineKeyboardMarkup()
-        for order in orders:
-            total_items = OrderItem.objects.filter(order=order).count()
-            callback_data = f"remove_order_{order.id}"  # Use order ID for removal
-            markup.add(InlineKeyboardButton(f"📦 Order ID: #{order.id} \n🛒 Cartons Ordered: ({total_items})", callback_data=callback_data))
-        
-        bot.send_message(call.message.chat.id, 
-            "*❌ Time to make some space!* \nSelect the order you'd like to remove from your cart: 🛒👇",
-            parse_mode="Markdown",
-            reply_markup=markup)
+        for item in items:
+            markup.add(InlineKeyboardButton(f"❌ {item.product.title} x {item.quantity}", callback_data=encode("remove_item", item.id)))
+        markup.add(InlineKeyboardButton("🔙 Back to Cart", callback_data=encode("cart")))
+
+        show_screen(call.message, 
+            "*❌ Time to make some space!* \nSelect the item you'd like to remove from your cart: 🛒👇",
+            markup,
+            edit=True)
     else:
-        bot.send_message(call.message.chat.id, 
-            "^🛒 Your cart is empty! 😢* \nLooks like you haven't added any cartons of Indomie yet. Select your favorite carton(s) and let’s get the party started! 🍜🔥",
-            parse_mode="Markdown")
+        show_screen(call.message, empty_cart, edit=True)
     
     bot.answer_callback_query(call.id)
 
 
 
 
-# Handle specific order removal
-@bot.callback_query_handler(func=lambda call: call.data.startswith("remove_order_"))
-def handle_remove_order(call):
+# Handle specific item removal
+@router.route("remove_item", int)
+def handle_remove_item(call, item_id):
     """
-    Handles the removal of a specific order.
+    Removes an item from the user's cart, the picker turns back into the updated cart.
     """
-    order_id = int(call.data.split("_")[2])  # Extract order ID from callback data
+    item = cart.remove_item(call.from_user.id, item_id)
+    send_cart(call.message, call.from_user.id, edit=True)
 
-    try:
-        # Find and delete the order along with its items
-        order = Order.objects.get(id=order_id)
-        order.delete()
-        
-        bot.send_message(call.message.chat.id, 
-            f"🚫 *Order #{order_id}* has been removed from your cart. 😢\nWant to double-check? Click /cart to confirm! 🛒✨",
-            parse_mode="Markdown")
+    if item:
+        bot.answer_callback_query(call.id, f"🚫 {item.product.title} has been removed from your cart.")
+    else:
+        bot.answer_callback_query(call.id, "⚠️ That item is already gone from your cart.")
 
-    except Order.DoesNotExist:
-        bot.send_message(call.message.chat.id, 
+
+
+
+# Handle clearing the cart
+@router.route("remove_order", int)
+def handle_remove_order(call, order_id):
+    """
+    Handles the removal of the user's cart along with its items.
+    """
+    # only ever the user's own unpayed order
+    if cart.clear_cart(call.from_user.id, order_id):
+        show_screen(call.message, 
+            f"🚫 *Order #{order_id}* has been removed from your cart. 😢\nWant to double-check? Click /cart to confirm! 🛒✨",
+            edit=True)
+    else:
+        outbox.send_message(call.message.chat.id, 
             "⚠️ *Order not found!* 😕\nLooks like something went wrong. Please try again! 🔄✨",
             parse_mode="Markdown")
     
@@ -414,39 +316,43 @@ def handle_remove_order(call):
 
 
 
-# Handle the checkout callback for a single order
-@bot.callback_query_handler(func=lambda call: call.data.startswith("process_checkout_"))
-def process_single_checkout(call):
-    """
-    Handles the checkout for a specific order and redirects to Paystack for payment.
-    """
-    order_id = int(call.data.split("_")[2])
+# Handle the "Back to Cart" buttons
+@router.route("cart")
+def handle_cart(call):
 
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
 
-    try:
-        order = Order.objects.get(id=order_id, payed=False)
-        total_amount = 0
-        items = OrderItem.objects.filter(order=order)
-        item_details = ""
+    send_cart(call.message, call.from_user.id, edit=True)
+    bot.answer_callback_query(call.id)
 
-        for item in items:
-            total_amount += item.product.price * item.quantity
-            item_details += f"*📦 {item.product.title} x{item.quantity}* \n💰 Total: ₦{item.product.price * item.quantity} 🍜"
 
-        # Create a Paystack transaction request
-        payment_url = create_paystack_payment(total_amount, order_id)
 
-        # Send message with payment link
-        bot.send_message(
-            call.message.chat.id,
-            f"*🚀 You're checking out Order id: #{order_id}:* \n{item_details}\n💰 *Total: ₦{total_amount}* 🍜\n\n" 
-            "🎉 Ready to finish up? Click the link below to complete your payment and get your Indomie on the way! 🛒👇\n" + payment_url,
-            parse_mode="Markdown")
-        order.save()
+
+# Handle the checkout button of the cart
+@router.route("checkout_cart")
+def handle_checkout_cart(call):
+    checkout_cart_command(call, is_callback=True)
+    bot.answer_callback_query(call.id)
+
+
+
+
+# Handle the checkout callback for a single order, sent by order pickers from before carts were merged
+@router.route("process_checkout", int)
+def process_single_checkout(call, order_id):
+    """
+    Handles the checkout for a specific order and redirects to Paystack for payment.
+    """
+    # included to stop any register next step handlers from executing
+    bot.clear_step_handler(call.message)
+
+    try:
+        # only ever the user's own unpayed order
+        order = Order.objects.with_items().get(id=order_id, user_id=call.from_user.id, payed=False)
+        send_checkout(call.message, order, edit=True)
     except Order.DoesNotExist:
-        bot.send_message(call.message.chat.id, 
+        outbox.send_message(call.message.chat.id, 
             "❌*Order not found or already checked out.* \nPlease try another order 😊",
             parse_mode="Markdown")
     
@@ -454,48 +360,49 @@ def process_single_checkout(call):
 
 
 
-# Handle other callbacks without specific query handlers
-@bot.callback_query_handler(func=lambda call: True)
-def handle_other_callbacks(call):
+# Handle the "next page" button of the /payed order history
+@router.route("payed_before", int)
+def handle_payed_orders_page(call, before_id):
+    """
+    Sends the page of the user's payed orders older than order before_id.
+    """
+    send_payed_orders_page(call.message.chat.id, call.from_user.id, before_id)
+    bot.answer_callback_query(call.id)
+
+
+
+# "next page" buttons sent when pages held a fixed number of orders, they start over from the newest
+@router.route("payed_page", int)
+def handle_legacy_payed_orders_page(call, page):
+    send_payed_orders_page(call.message.chat.id, call.from_user.id)
+    bot.answer_callback_query(call.id)
+
+
+
+# Handle the buttons of the /start menu
+@router.route("products")
+def products_callback(call):
 
     # included to stop any register next step handlers from executing
     bot.clear_step_handler(call.message)
 
-    if call.data == "products":
-        products(call.message)
-    elif call.data == "help":
-        help_command(call.message)
-    elif call.data == "checkout_single_order":
-        checkout_single_order_command(call, is_callback=True)
-
+    products(call.message, edit=True)
     bot.answer_callback_query(call.id)
-# ======================= HELPER FUNCTIONS =======================
 
 
 
-def create_paystack_payment(amount, order_id):
-    """
-    Creates a Paystack payment link and returns the URL to redirect the user for payment.
-    """
-    headers = {
-        'Authorization': f'Bearer {settings.PAYSTACK_SECRET_KEY}',
-    }
+@router.route("help")
+def help_menu_callback(call):
 
-    data = {
-        'amount': amount * 100,  # Convert to kobo (Paystack expects the amount in kobo)
-        'email': 'user_email@example.com',  # Replace with the user's email
-        'order_id': order_id,  # Your custom order ID (you may pass this from your order model)
-        'callback_url': f'{website_link}/paystack/callback/?order_id={order_id}',  # Include order_id in callback URL
-    }
+    # included to stop any register next step handlers from executing
+    bot.clear_step_handler(call.message)
 
-    response = requests.post('https://api.paystack.co/transaction/initialize', headers=headers, data=data)
-    response_data = response.json()
+    help_command(call.message, edit=True)
+    bot.answer_callback_query(call.id)
 
-    if response_data['status']:
-        payment_url = response_data['data']['authorization_url']
-        return payment_url
-    else:
-        return None
+
+
+# ======================= HELPER FUNCTIONS =======================
 
 
 
@@ -506,23 +413,35 @@ def get_quantity(message):
     try:
         quantity = int(message.text)
         user_id = message.from_user.id
-        if user_id in user_orders and quantity:
-            user_orders[user_id]["quantity"] = quantity
-            msg = bot.send_message(message.chat.id, 
+        order_data = user_orders.get(user_id)
+        if order_data and quantity:
+            # with a cart already open the product joins it, its delivery details are reused
+            item = cart.add_to_cart(user_id, order_data["product_id"], quantity)
+            if item:
+                user_orders.delete(user_id)
+                send_added_to_cart(message.chat.id, item)
+                return
+
+            order_data["quantity"] = quantity
+            user_orders.set(user_id, order_data)
+            outbox.send_message(message.chat.id, 
                 "📧 Please drop your email so we can keep you updated on your transactions! (e.g., `youremail@example.com`): ✨👇",
                 parse_mode="Markdown")
-            bot.register_next_step_handler(msg, get_email)
+            bot.register_next_step_handler(message, get_email)
         else:
-            # Debug: User order not found
-            print(f"User {user_id} has no active order.")
-            bot.send_message(message.chat.id, 
+            logger.info("User %s sent a quantity without an active order", user_id)
+            outbox.send_message(message.chat.id, 
                 no_active_order, 
                 parse_mode="Markdown")
     except ValueError:
-        bot.send_message(message, 
+        outbox.send_message(message.chat.id, 
             "*⚠️ Oops! That doesn’t look like a valid number of cartons. 😕* \nPlease enter a valid number (e.g., 5 cartons) so we can get your order right! 📦✨",
             parse_mode="Markdown")
         bot.register_next_step_handler(message, get_quantity)  # Retry quantity input
+    except Product.DoesNotExist:
+        outbox.send_message(message.chat.id, 
+            "*❌ Oops! This product seems to have vanished into thin air!* It's probably a problem from our end\n🚀💨 Try selecting another one. 🍜😉",
+            parse_mode="Markdown")
 
 
 
@@ -531,20 +450,21 @@ def get_email(message):
     user_id = message.from_user.id
 
     if re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", email):
-        if user_id in user_orders:
-            user_orders[user_id]["email"] = email
-            msg = bot.send_message(message.chat.id, 
+        order_data = user_orders.get(user_id)
+        if order_data:
+            order_data["email"] = email
+            user_orders.set(user_id, order_data)
+            outbox.send_message(message.chat.id, 
                 "*📛 Who's receiving your delivery?* \n🤩 Please enter their _full name_ below: 👇", 
                 parse_mode="Markdown")
-            bot.register_next_step_handler(msg, get_fullname)
+            bot.register_next_step_handler(message, get_fullname)
         else:
-            # Debug: User order not found
-            print(f"User {user_id} has no active order.")
-            bot.send_message(message.chat.id, 
+            logger.info("User %s sent an email without an active order", user_id)
+            outbox.send_message(message.chat.id, 
                 no_active_order,
                 parse_mode="Markdown")
     else:
-        bot.send_message(message.chat.id, 
+        outbox.send_message(message.chat.id, 
             "*📧 Oops! That doesn't look like a valid email. 😕* \nPlease enter a correct email address (e.g., `youremail@example.com`): ✨👇",
             parse_mode="Markdown")
         bot.register_next_step_handler(message, get_email)
@@ -555,32 +475,20 @@ def get_fullname(message):
     fullname = message.text
     user_id = message.from_user.id
 
-    if user_id in user_orders:
-        user_orders[user_id]["fullname"] = fullname
+    order_data = user_orders.get(user_id)
+    if order_data:
+        order_data["fullname"] = fullname
+        user_orders.set(user_id, order_data)
         
         # Show hall options with buttons
-        markup = InlineKeyboardMarkup()
-        markup.add(
-            InlineKeyboardButton("Paul Hall", callback_data="hall_Paul"),
-            InlineKeyboardButton("Joseph Hall", callback_data="hall_Joseph"),
-            InlineKeyboardButton("Peter Hall", callback_data="hall_Mary"),
-            InlineKeyboardButton("John Hall", callback_data="hall_John"),
-            InlineKeyboardButton("Daniel Hall", callback_data="hall_Daniel"),
-            InlineKeyboardButton("Mary Hall", callback_data="hall_Mary"),
-            InlineKeyboardButton("Lydia Hall", callback_data="hall_Lydia"),
-            InlineKeyboardButton("Deborah Hall", callback_data="hall_Deborah"),
-            InlineKeyboardButton("Dorcas Hall", callback_data="hall_Dorcas"),
-            InlineKeyboardButton("Esther Hall", callback_data="hall_Esther"),
-        )
-        msg = "🏠 *Where should we deliver your Indomie?* 🍜🚀 \nPlease select the hall for delivery: 👇"
-        bot.send_message(message.chat.id, 
-            msg, 
-            reply_markup=markup, 
+        screen = screens.get_screen("halls")
+        outbox.send_message(message.chat.id, 
+            screen["msg"], 
+            reply_markup=screen["markup"], 
             parse_mode="Markdown")
     else:
-        # Debug: User order not found
-        print(f"User {user_id} has no active order.")
-        bot.send_message(message.chat.id, 
+        logger.info("User %s sent a name without an active order", user_id)
+        outbox.send_message(message.chat.id, 
                 no_active_order,
                 parse_mode="Markdown")
 
@@ -594,91 +502,225 @@ def get_room_no(message):
         room_no = message.text
         pattern = "^[A-H]{1}+[1-4]{1}+[0-8]{2}$"
         if re.match(pattern, room_no):
-            bot.send_message(message.chat.id, 
+            outbox.send_message(message.chat.id, 
                 f"*✅ Great! Your room number is {room_no} 🏠🚪 We’ve got it noted! 🎉*",
                 parse_mode="Markdown")
         else:
-            bot.send_message(message.chat.id,
+            outbox.send_message(message.chat.id,
                 "*⚠️ Oops! That doesn’t seem right.* 😕 \nPlease enter a valid room number (e.g., A203). 🏠🔢",
                 parse_mode="Markdown")
             bot.register_next_step_handler(message, get_room_no)
             return # Exit function if invalid
 
         user_id = message.from_user.id
-        if user_id in user_orders:
-            user_orders[user_id]["room_no"] = room_no
-            order_data = user_orders[user_id]
-
-            # Save the incomplete order to the database
-            product = Product.objects.get(id=order_data["product_id"])
-            order, created = Order.objects.get_or_create(
-                user_id=message.from_user.id,
-                full_name = order_data["fullname"],
-                username=message.from_user.username or "Anonymous",
-                hall=order_data["hall"],
-                email = order_data["email"],
-                room_no=order_data["room_no"],
-                payed=False,
-                delivery_date = DeliveryDate.objects.order_by("-id").first()
-            )
-            if created:
-                OrderItem.objects.create(order=order, product=product, quantity=order_data["quantity"])
-                bot.send_message(
-                    message.chat.id,
-                    f"*✅ {product.title} has been added to your cart!* 🛒🎉\nUse /cart to check out your tasty selection! 🍜🔥",
-                    parse_mode="Markdown"
-                )
-            else:
-                raise Exception
-
+        order_data = user_orders.get(user_id)
+        if order_data:
+            order_data["room_no"] = room_no
+
+            # Start the user's cart with this product
+            item = cart.add_to_cart(user_id, order_data["product_id"], order_data["quantity"], details={
+                "username": message.from_user.username or "Anonymous",
+                "email": order_data["email"],
+                "full_name": order_data["fullname"],
+                "hall": order_data["hall"],
+                "room_no": order_data["room_no"],
+            })
+            # the order is in the database now, no need to keep it around
+            user_orders.delete(user_id)
+            send_added_to_cart(message.chat.id, item)
         else:
-            # Debug: User order not found
-            print(f"User {user_id} has no active order.")
-            bot.send_message(message.chat.id, 
+            logger.info("User %s sent a room number without an active order", user_id)
+            outbox.send_message(message.chat.id, 
                 no_active_order,
                 parse_mode="Markdown")
 
-    except Exception as e:
-        bot.send_message(message.chat.id, 
+    except Exception:
+        outbox.send_message(message.chat.id, 
         "*⚠️ Oops! Something went wrong on our end. 😢* \nNo worries, it’s not your fault! 🙏 Please try again later—we’ll have it fixed soon! 🔧🚀",
         parse_mode="Markdown")
-        print(e)
+        # counted as handler.get_room_no.errors and logged with its traceback by the dispatcher
+        raise
 
 
 
 
-def checkout_single_order_command(update, is_callback = False):
+def send_payed_orders_page(chat_id, user_id, before_id=None):
     """
-    Prompt the user to select a single order to checkout.
+    Sends one page of the user's payed orders, newest first, starting after order before_id when given.
+    Orders are added until the message would get too long for telegram, the next page button carries the id of
+    the last one shown.
     """
-    user_id = update.from_user.id
-    orders = Order.objects.filter(user_id=user_id, payed=False)
+    orders = Order.objects.filter(user_id=user_id, payed=True)
+    if before_id is not None:
+        orders = orders.filter(id__lt=before_id)
+    # orders, delivery dates and receipts in one query, items and products in another.
+    # one extra order is fetched to know if there's a next page
+    orders = list(orders.with_items().select_related("reciept").order_by("-id")[:PAYED_ORDERS_PER_PAGE + 1])
+
+    if not orders:
+        outbox.send_message(chat_id, 
+                     "*You haven't checked out any orders yet*. 😕\nUse /cart to view unpayed orders 🛒\nUse /checkout to checkout an order 💳\nUse /products to view available products 🍜",
+                     parse_mode="Markdown")
+        return
 
-    if is_callback:
-        chat_id = update.message.chat.id
-        # included to stop any register next step handlers from executing
-        bot.clear_step_handler(update.message)
+    if before_id is None:
+        msg = "*Your Checked Out Orders* 🎉\n✨ Your Indomie is on its way! 🚀🍜\n\n"
     else:
-        chat_id = update.chat.id
-        # included to stop any register next step handlers from executing
-        bot.clear_step_handler(update)
+        msg = "*Your Older Checked Out Orders* 🎉\n\n"
+
+    shown = 0
+    for order in orders[:PAYED_ORDERS_PER_PAGE]:
+        # the first order always goes in, cut down to what fits if it's a huge one
+        order_msg = payed_order_text(order, PAYED_PAGE_MAX_LENGTH - message_length(msg) if not shown else None)
+        if shown and message_length(msg + order_msg) > PAYED_PAGE_MAX_LENGTH:
+            break
+        msg += order_msg
+        shown += 1
+
+    markup = None
+    if shown < len(orders):
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("Next page ➡️", callback_data=encode("payed_before", orders[shown - 1].id)))
+
+    outbox.send_message(chat_id, 
+        msg, 
+        parse_mode="Markdown",
+        reply_markup=markup)
+
+
+
+
+def payed_order_text(order, max_length=None):
+    """
+    An order's entry in /payed: its receipt link, delivery date and status once, then a line per item.
+    Items that would take it past max_length are left out and counted instead.
+    """
+    try:
+        receipt = order.reciept
+        delivery_url = website_link + reverse("paystack_callback") + f"?order_id={order.id}&trxref={receipt.trxref}&reference={receipt.reference}"
+        receipt_link = f"[🎫 Click here to see receipt]({delivery_url}) \n"
+    except Reciept.DoesNotExist:
+        receipt_link = ""
+
+    msg = (
+        f"*Order id: #{order.id}* 🛒: \n{receipt_link}"
+        f"*📅 Delivery date:* {order.delivery_date}\n*✅ Delivered:* {'Yes' if order.delivered else 'No'}\n"
+    )
+    items = order.orderitem_set.all()
+    for shown, item in enumerate(items):
+        line = f"🍜 *{item.product.title}* x {item.quantity} - (₦{item.unit_price * item.quantity})\n"
+        # leaves room for the "more items" line
+        if max_length is not None and message_length(msg + line) > max_length - 40:
+            msg += f"_...and {len(items) - shown} more items_\n"
+            break
+        msg += line
+    return msg + "\n\n"
+
+
 
 
-    if orders.exists():
+def message_length(text):
+    # telegram counts utf-16 code units, most emoji are two of them
+    return len(text.encode("utf-16-le")) // 2
+
+
+
+
+def send_added_to_cart(chat_id, item):
+    outbox.send_message(
+        chat_id,
+        f"*✅ {item.product.title} has been added to your cart!* 🛒🎉\nUse /cart to check out your tasty selection! 🍜🔥",
+        parse_mode="Markdown"
+    )
+
+
+
+
+def send_cart(message, user_id, edit=False):
+    """
+    Shows the user's cart, in place of message when edit is true.
+    """
+    order = cart.open_order(user_id)
+
+    if order:
+        msg = "*Hi, Here's your Cart items 🛒:*\n..................☆*: .｡. o(≧▽≦)o .｡.:*☆.....................\n\n"
         markup = InlineKeyboardMarkup()
-        for order in orders:
-            markup.add(InlineKeyboardButton(f"Order id: #{order.id}", callback_data=f"process_checkout_{order.id}"))
-    
-        bot.send_message(chat_id, 
-            "🛒 *Select an order to checkout:* 🎉\nYour Indomie is waiting! 😋 Ready to complete your order?",
-            parse_mode="Markdown",
-            reply_markup=markup)
+
+        for item in order.orderitem_set.all():
+            msg += f"🍜 *{item.product.title}* x {item.quantity} - (₦{item.unit_price * item.quantity})\n"
+        msg += (
+            f"\n*💰 Total:* ₦{order.total}\n"
+            f"*🏠 Delivering to:* {order.hall} Hall, room {order.room_no}\n"
+            f"*📅 Delivery date:* {order.delivery_date}\n\n"
+            "Add more products from /products, they'll join this cart. 🍜"
+        )
+
+        # Add buttons for checkout, remove and clear
+        checkout = InlineKeyboardButton("💳 Checkout", callback_data=encode("checkout_cart"))
+        remove_from_cart = InlineKeyboardButton("Remove an Item", callback_data=encode("remove_item_cart"))
+        clear = InlineKeyboardButton("🗑️ Clear Cart", callback_data=encode("remove_order", order.id))
+
+        # Add buttons to the markup
+        markup.add(checkout)
+        markup.add(remove_from_cart, clear)
+
+        show_screen(message, msg, markup, edit=edit)
     else:
-    
-        bot.send_message(chat_id, 
-            "❌ *No unpayed orders found!* 😕\nLooks like you haven't added anything to cart yet. Go ahead and pick some carton(s) of Indomie! 🍜🎉",
+        show_screen(message, empty_cart, edit=edit)
+
+
+
+
+def checkout_cart_command(update, is_callback = False):
+    """
+    Checks out everything in the user's cart in one payment.
+    """
+    user_id = update.from_user.id
+    order = cart.open_order(user_id)
+
+    if is_callback:
+        message = update.message
+    else:
+        message = update
+    # included to stop any register next step handlers from executing
+    bot.clear_step_handler(message)
+
+    if order:
+        send_checkout(message, order, edit=is_callback)
+    else:
+        show_screen(message, 
+            "❌ *Your cart is empty!* 😕\nLooks like you haven't added anything to cart yet. Go ahead and pick some carton(s) of Indomie! 🍜🎉",
+            edit=is_callback)
+
+
+
+
+def send_checkout(message, order, edit=False):
+    """
+    Sends the paystack link for an order (loaded with_items) and its total, in place of message when edit is true.
+    """
+    item_details = ""
+    for item in order.orderitem_set.all():
+        item_details += f"*📦 {item.product.title} x{item.quantity}* \n💰 Total: ₦{item.unit_price * item.quantity} 🍜\n"
+
+    # Reuse the order's paystack link or create a new transaction
+    payment_url = payments.get_payment_url(order.id, order.total)
+    if payment_url is None:
+        outbox.send_message(message.chat.id, 
+            "*⚠️ We couldn't reach our payment provider right now. 😢* \nPlease try checking out again in a moment. 🔄",
             parse_mode="Markdown")
-    
+        return
+
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("🔙 Back to Cart", callback_data=encode("cart")))
+
+    # Show the payment link
+    show_screen(
+        message,
+        f"*🚀 You're checking out Order id: #{order.id}:* \n{item_details}\n💰 *Total: ₦{order.total}* 🍜\n\n" 
+        "🎉 Ready to finish up? Click the link below to complete your payment and get your Indomie on the way! 🛒👇\n" + payment_url,
+        markup,
+        edit=edit)
 
 
 
@@ -687,4 +729,20 @@ def checkout_single_order_command(update, is_callback = False):
 
 def start_bot():
     print("Indomie Bot is running")
-    bot.polling(none_stop=True)
\ No newline at end of file
+    # telegram refuses getUpdates while a webhook is registered
+    bot.remove_webhook()
+    bot.polling(none_stop=True)
+
+
+def set_webhook():
+    """
+    Registers the django webhook view with telegram so updates are pushed to the web process instead of polled.
+    Raises ImproperlyConfigured without a TELEGRAM_WEBHOOK_SECRET, the view refuses every update then.
+    """
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise ImproperlyConfigured("Set TELEGRAM_WEBHOOK_SECRET before registering the webhook")
+
+    webhook_url = website_link.rstrip("/") + reverse("telegram_webhook")
+    bot.remove_webhook()
+    bot.set_webhook(url=webhook_url, secret_token=settings.TELEGRAM_WEBHOOK_SECRET)
+    return webhook_url
\ No newline at end of file
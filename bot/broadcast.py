@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import wait
+
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from bot import notifications
+from bot.models import Broadcast, Order
+
+
+
+def delivery_date_message(delivery_date):
+    return (
+        "*📅 Delivery date update!* 🚚\n"
+        f"Your Indomie will be delivered to your hall on *{delivery_date}*. 🍜🎉\n"
+        "Use /payed to see your orders."
+    )
+
+
+def buyer_ids(after_user_id=None, chunk_size=1000):
+    """
+    Streams the distinct user ids of buyers with a payed, undelivered order, in ascending order,
+    without loading them all into memory.
+    """
+    orders = Order.objects.filter(payed=True, delivered=False)
+    if after_user_id is not None:
+        orders = orders.filter(user_id__gt=after_user_id)
+    return orders.order_by("user_id").values_list("user_id", flat=True).distinct().iterator(chunk_size=chunk_size)
+
+
+def run_broadcast(broadcast, chunk_size=500, progress=None):
+    """
+    Sends a broadcast through the rate-limited outbox, starting after its last checkpoint.
+
+    Each chunk of users is checkpointed once telegram has taken (or refused) all its messages,
+    so running a broadcast again only messages the users it hadn't reached yet.
+    """
+    chunk = []
+    for user_id in buyer_ids(broadcast.last_user_id, chunk_size):
+        chunk.append(user_id)
+        if len(chunk) == chunk_size:
+            send_chunk(broadcast, chunk)
+            chunk = []
+            if progress:
+                progress(broadcast)
+    if chunk:
+        send_chunk(broadcast, chunk)
+
+    broadcast.completed_at = timezone.now()
+    Broadcast.objects.filter(id=broadcast.id).update(completed_at=broadcast.completed_at)
+    if progress:
+        progress(broadcast)
+    return broadcast
+
+
+def send_chunk(broadcast, user_ids):
+    futures = [notifications.send_message(user_id, broadcast.message, parse_mode="Markdown") for user_id in user_ids]
+    wait(futures)
+    failed = sum(1 for future in futures if future.exception() is not None)
+
+    broadcast.last_user_id = user_ids[-1]
+    broadcast.sent_count += len(user_ids) - failed
+    broadcast.failed_count += failed
+    Broadcast.objects.filter(id=broadcast.id).update(
+        last_user_id=broadcast.last_user_id,
+        sent_count=F("sent_count") + len(user_ids) - failed,
+        failed_count=F("failed_count") + failed,
+    )
+
+
+def start_broadcast_thread(broadcast):
+    """
+    Runs a broadcast in the background, for the admin. An interrupted one can be resumed with
+    `python manage.py broadcast_delivery_date --resume <id>`.
+    """
+    def run():
+        try:
+            run_broadcast(broadcast)
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name=f"broadcast-{broadcast.id}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,68 @@
+from django.db import transaction
+
+from bot.models import DeliveryDate, Order, OrderItem, Product
+
+
+
+def open_order(user_id):
+    """
+    Returns the user's cart, their one unpayed order with its items and products, or None if it's empty.
+    """
+    # one query for the cart and its delivery date, one for the items and products
+    return Order.objects.filter(user_id=user_id, payed=False).with_items().first()
+
+
+def add_to_cart(user_id, product_id, quantity, details=None):
+    """
+    Adds quantity cartons of a product to the user's cart, on top of any already in it.
+
+    The cart is created from details (username, email, full_name, hall and room_no) when the user has none,
+    so delivery details are only asked for once per cart. Returns the cart's item for the product, or None when
+    there's no cart and no details to start one. Raises Product.DoesNotExist for unknown products.
+    """
+    product = Product.objects.get(id=product_id)
+    with transaction.atomic():
+        # the lock keeps two adds for the same user from racing on the item's quantity
+        order = Order.objects.select_for_update().filter(user_id=user_id, payed=False).first()
+        if order is None:
+            if details is None:
+                return None
+            order = Order.objects.create(
+                user_id=user_id,
+                payed=False,
+                delivery_date=DeliveryDate.objects.order_by("-id").first(),
+                **details,
+            )
+
+        item = order.orderitem_set.filter(product=product).first()
+        if item:
+            item.quantity += quantity
+            item.save()
+        else:
+            item = OrderItem.objects.create(order=order, product=product, quantity=quantity)
+    return item
+
+
+def remove_item(user_id, item_id):
+    """
+    Removes an item from the user's cart, and the cart itself once it's empty.
+    Returns the removed item, or None if it isn't in the user's cart.
+    """
+    with transaction.atomic():
+        item = OrderItem.objects.select_related("order", "product").filter(
+            id=item_id, order__user_id=user_id, order__payed=False
+        ).first()
+        if item is None:
+            return None
+        item.delete()
+        if not OrderItem.objects.filter(order_id=item.order_id).exists():
+            item.order.delete()
+    return item
+
+
+def clear_cart(user_id, order_id):
+    """
+    Deletes the user's cart with its items if it's still the order order_id, returns whether it was.
+    """
+    deleted, _ = Order.objects.filter(id=order_id, user_id=user_id, payed=False).delete()
+    return bool(deleted)
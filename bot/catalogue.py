@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.models import Product
+from bot.router import encode
+
+
+CACHE_KEY = "bot:catalogue"
+
+_lock = threading.Lock()
+_catalogue = None
+_expires_at = 0
+
+
+
+def build_catalogue():
+    """
+    Renders the product list keyboard and every product's detail text and keyboard in one query.
+    Keyboards are stored as serialized json, which telebot sends as is.
+    """
+    list_markup = InlineKeyboardMarkup()
+    details = {}
+    for product in Product.objects.all():
+        list_markup.add(InlineKeyboardButton(f"{product.title}", callback_data=encode("product", product.id)))
+
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("Add to Cart 🛒", callback_data=encode("order", product.id)))
+        markup.add(InlineKeyboardButton("🔙 Back", callback_data=encode("products")))
+        details[product.id] = {
+            "title": product.title,
+            "msg": f"*📦 {product.title}* - 💰 ₦{product.price} 🍜\n📝 {product.description}",
+            "markup": markup.to_json(),
+        }
+
+    return {"list_markup": list_markup.to_json(), "products": details}
+
+
+def get_catalogue():
+    """
+    Returns the rendered catalogue, building it only when the cache is empty.
+
+    With settings.CATALOGUE_CACHE set to a cache alias the catalogue is kept in that shared cache, otherwise in
+    this process. Either way it's rebuilt after settings.CATALOGUE_CACHE_TTL seconds, in case an invalidation was missed.
+    """
+    global _catalogue, _expires_at
+
+    if settings.CATALOGUE_CACHE:
+        cache = caches[settings.CATALOGUE_CACHE]
+        catalogue = cache.get(CACHE_KEY)
+        if catalogue is None:
+            catalogue = build_catalogue()
+            cache.set(CACHE_KEY, catalogue, timeout=settings.CATALOGUE_CACHE_TTL)
+        return catalogue
+
+    with _lock:
+        if _catalogue is None or _expires_at < time.monotonic():
+            _catalogue = build_catalogue()
+            _expires_at = time.monotonic() + settings.CATALOGUE_CACHE_TTL
+        return _catalogue
+
+
+def product_list_markup():
+    return get_catalogue()["list_markup"]
+
+
+def get_product_detail(product_id):
+    """
+    Returns the detail of a product as a dict with its title, msg and markup, or None if it doesn't exist.
+    """
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return None
+    return get_catalogue()["products"].get(product_id)
+
+
+def invalidate():
+    global _catalogue
+
+    with _lock:
+        _catalogue = None
+    if settings.CATALOGUE_CACHE:
+        caches[settings.CATALOGUE_CACHE].delete(CACHE_KEY)
@@ -0,0 +1,190 @@
+import functools
+import logging
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from telebot import apihelper
+from django.db import close_old_connections, connection
+
+from bot import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+
+def update_chat_id(update):
+    """
+    Returns the id of the chat an update belongs to, or None for updates without one.
+    """
+    message = update.message or update.edited_message
+    if message:
+        return message.chat.id
+
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+
+    return None
+
+
+
+class ChatDispatcher:
+    """
+    Runs updates on a bounded pool of worker threads.
+
+    Updates from different chats run concurrently, updates from the same chat run one at a time
+    and in the order they arrived, so a user's step handler chain still sees its messages in order.
+    With num_threads=0 updates are handled inline on the calling thread.
+    """
+
+    def __init__(self, handle, num_threads=4):
+        self.handle = handle
+        self.executor = None
+        if num_threads:
+            self.executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="bot-dispatch")
+
+        self.lock = threading.Condition()
+        # chat_id -> updates waiting for the chat's running update to finish
+        self.pending = {}
+
+    def submit(self, chat_id, update):
+        if self.executor is None:
+            self._handle(update)
+            return
+
+        with self.lock:
+            if chat_id in self.pending:
+                self.pending[chat_id].append(update)
+                return
+            self.pending[chat_id] = deque()
+
+        self.executor.submit(self._run, chat_id, update)
+
+    def join(self):
+        """
+        Waits for every queued update to be handled.
+        """
+        with self.lock:
+            while self.pending:
+                self.lock.wait()
+
+    def shutdown(self):
+        """
+        Waits for every queued update to be handled, then stops the worker threads.
+        """
+        if self.executor is None:
+            return
+
+        self.join()
+        self.executor.shutdown(wait=True)
+
+    def _run(self, chat_id, update):
+        self._handle(update)
+
+        with self.lock:
+            waiting = self.pending[chat_id]
+            if not waiting:
+                del self.pending[chat_id]
+                self.lock.notify_all()
+                return
+            update = waiting.popleft()
+
+        # requeue instead of looping so a busy chat can't hold on to a worker
+        self.executor.submit(self._run, chat_id, update)
+
+    def _handle(self, update):
+        try:
+            self.handle(update)
+        except Exception:
+            logger.exception("Error while handling update %s", update.update_id)
+        finally:
+            # worker threads keep their own db connection, drop it if it's gone stale
+            close_old_connections()
+
+
+
+class QueryCounter:
+    """
+    Counts the queries run on this thread's db connection while installed with connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+
+def instrument_handler(handler):
+    """
+    Wraps a bot handler so each call is timed as handler.<function name>.
+    """
+    return metrics.instrumented(handler, f"handler.{handler.__name__}")
+
+
+def instrument_api_requests():
+    """
+    Times every telegram api call as telegram.<method>, e.g. sendMessage as telegram.send_message, whether it's
+    sent through the outbox or straight from a handler or polling. Wraps apihelper._make_request, which every
+    TeleBot method goes through, once per process.
+    """
+    make_request = apihelper._make_request
+    if getattr(make_request, "instrumented", False):
+        return
+
+    @functools.wraps(make_request)
+    def timed_request(token, method_name, *args, **kwargs):
+        name = re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", method_name).lower()
+        with metrics.timed(f"telegram.{name}"):
+            return make_request(token, method_name, *args, **kwargs)
+
+    timed_request.instrumented = True
+    apihelper._make_request = timed_request
+
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """
+    TeleBot that hands each update to a ChatDispatcher instead of running handlers on the polling thread.
+
+    Every update is timed as bot.update with the db queries it ran in bot.update.queries, every handler,
+    including next step handlers, is timed as handler.<function name> and every api call as telegram.<method>.
+    """
+
+    def __init__(self, token, num_threads=4, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        instrument_api_requests()
+        self.dispatcher = ChatDispatcher(self._process_update, num_threads)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # polling asks for last_update_id + 1 next, so move it on before the handlers have run
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update_chat_id(update), update)
+
+    def _process_update(self, update):
+        counter = QueryCounter()
+        try:
+            with metrics.timed("bot.update"), connection.execute_wrapper(counter):
+                super().process_new_updates([update])
+        finally:
+            metrics.observe("bot.update.queries", counter.count, buckets=metrics.COUNT_BUCKETS)
+
+    @staticmethod
+    def _build_handler_dict(handler, pass_bot=False, **filters):
+        return telebot.TeleBot._build_handler_dict(instrument_handler(handler), pass_bot=pass_bot, **filters)
+
+    def register_next_step_handler_by_chat_id(self, chat_id, callback, *args, **kwargs):
+        super().register_next_step_handler_by_chat_id(chat_id, instrument_handler(callback), *args, **kwargs)
+
+    def stop_bot(self):
+        super().stop_bot()
+        self.dispatcher.shutdown()
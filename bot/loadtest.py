@@ -0,0 +1,104 @@
+"""
+Replays synthetic update streams against the real handlers, see the benchmark_bot command.
+"""
+import json
+import time
+from itertools import zip_longest
+
+from telebot.types import Update
+
+from bot import metrics
+from bot.router import encode
+from bot.testing import callback_update, message_update
+
+
+# first synthetic telegram user id, far from any real one
+FIRST_USER_ID = 10 ** 12
+
+
+
+def checkout_flow(user_id, product_id, hall, quantity=2):
+    """
+    The updates of one user ordering a product and checking out:
+    /products, product, add to cart, quantity, email, name, hall, room number, checkout.
+    """
+    return [
+        message_update("/products", user_id),
+        callback_update(encode("product", product_id), user_id),
+        callback_update(encode("order", product_id), user_id),
+        message_update(str(quantity), user_id),
+        message_update(f"user{user_id}@example.com", user_id),
+        message_update(f"Load Test {user_id}", user_id),
+        callback_update(encode("hall", hall), user_id),
+        message_update("A204", user_id),
+        callback_update(encode("checkout_cart"), user_id),
+    ]
+
+
+def rush(user_count, product_ids, halls):
+    """
+    The updates of user_count users walking the checkout flow at the same time, as parsed Updates.
+    Users take their steps in turns, so every chat has updates waiting like in a real rush.
+    """
+    flows = [
+        checkout_flow(FIRST_USER_ID + n, product_ids[n % len(product_ids)], halls[n % len(halls)])
+        for n in range(user_count)
+    ]
+
+    updates = []
+    for step in zip_longest(*flows):
+        updates.extend(payload for payload in step if payload is not None)
+    for update_id, payload in enumerate(updates, start=1):
+        payload["update_id"] = update_id
+        # telegram message ids only need to be unique per chat
+        (payload.get("message") or payload["callback_query"]["message"])["message_id"] = update_id
+        if "callback_query" in payload:
+            payload["callback_query"]["id"] = str(update_id)
+
+    return [Update.de_json(json.dumps(payload)) for payload in updates]
+
+
+def replay(bot, updates):
+    """
+    Feeds updates to the bot like polling would and waits until they've all been handled.
+    Returns the seconds it took, every handler's timings are kept in bot.metrics' samples.
+    """
+    metrics.keep_samples()
+    metrics.reset()
+    start = time.perf_counter()
+    bot.process_new_updates(updates)
+    bot.dispatcher.join()
+    return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[round(fraction * (len(values) - 1))]
+
+
+def report(update_count, elapsed):
+    """
+    Sums up a replay: throughput, (name, calls, p50 ms, p99 ms, max ms) rows for every timed update, handler and
+    api call, the queries per update and the error counts.
+    """
+    samples = metrics.samples()
+    queries = samples.pop("bot.update.queries", None)
+    rows = [
+        (name, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values) * 1000)
+        for name, values in sorted(samples.items())
+        if name.startswith(("bot.update", "handler.", "callback.", "telegram.", "paystack."))
+    ]
+
+    return {
+        "updates": update_count,
+        "seconds": elapsed,
+        "throughput": update_count / elapsed if elapsed else 0,
+        "rows": rows,
+        "queries": queries and {
+            "mean": sum(queries) / len(queries),
+            "p50": percentile(queries, 0.5),
+            "p99": percentile(queries, 0.99),
+            "max": max(queries),
+        },
+        "errors": {name: value for name, value in metrics.snapshot()["counters"].items() if name.endswith(".errors")},
+    }
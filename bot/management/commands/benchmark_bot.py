@@ -0,0 +1,88 @@
+import datetime
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from bot import bot as handlers
+from bot import loadtest, metrics, paystack
+from bot.dispatch import ChatDispatcher
+from bot.models import DeliveryDate, Order, Product
+from bot.outbox import Outbox
+from bot.testing import PaystackStub, TelegramStub
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a rush of synthetic users walking the product to checkout flow against the real handlers, "
+        "with telegram and paystack stubbed out, and report throughput, handler latencies and queries per update"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Number of synthetic users, each sends 9 updates")
+        parser.add_argument("--products", type=int, default=5, help="Number of products the users pick from")
+        parser.add_argument("--threads", type=int, default=settings.BOT_WORKER_THREADS, help="Handler threads, 0 handles updates inline")
+        parser.add_argument("--telegram-latency", type=float, default=0, help="Seconds each stubbed telegram call takes")
+        parser.add_argument("--paystack-latency", type=float, default=0, help="Seconds each stubbed paystack call takes")
+
+    def handle(self, *args, **options):
+        bot = handlers.bot
+        old_dispatcher, old_outbox = bot.dispatcher, handlers.outbox
+        bot.dispatcher = ChatDispatcher(bot._process_update, options["threads"])
+        # the stub has no rate limits, don't let the outbox hold messages back for them
+        handlers.outbox = Outbox(bot, global_rate=100000, chat_rate=100000, chat_burst=100000)
+
+        # everything happens in a test database so real orders are never touched
+        old_name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # sqlite's in memory test database locks whole tables, a file lets the handler threads wait their turn.
+            # transactions take the write lock up front, one that reads first can't wait for it once another writes
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "benchmark_bot.sqlite3")
+            connection.settings_dict["OPTIONS"].update(transaction_mode="IMMEDIATE", timeout=30)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with TelegramStub(delay=options["telegram_latency"]) as telegram, \
+                    PaystackStub(delay=options["paystack_latency"]) as paystack_stub, \
+                    override_settings(PAYSTACK_BASE_URL=paystack_stub.url):
+                # a session for the stub's port
+                paystack._session = None
+                updates = self.seed_rush(options["users"], options["products"])
+                self.stdout.write(f"Replaying {len(updates)} updates from {options['users']} users on {options['threads']} threads")
+
+                elapsed = loadtest.replay(bot, updates)
+                handlers.outbox.join()
+                results = loadtest.report(len(updates), elapsed)
+                carts = Order.objects.filter(payed=False).count()
+                links = Order.objects.exclude(payment_url__isnull=True).exclude(payment_url="").count()
+        finally:
+            bot.dispatcher.shutdown()
+            bot.dispatcher, handlers.outbox = old_dispatcher, old_outbox
+            paystack._session = None
+            metrics.keep_samples(False)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.write_report(results)
+        self.stdout.write(f"\n{carts} carts, {links} payment links, {len(telegram.calls)} telegram calls, {len(paystack_stub.requests)} paystack calls")
+
+    def seed_rush(self, user_count, product_count):
+        DeliveryDate.objects.create(date=datetime.date.today() + datetime.timedelta(days=7))
+        products = Product.objects.bulk_create(
+            Product(title=f"Indomie {n}", price=9000 + 500 * n, description="40 packs") for n in range(product_count)
+        )
+        return loadtest.rush(user_count, [product.id for product in products], settings.BOT_HALLS)
+
+    def write_report(self, results):
+        self.stdout.write(f"\n{results['updates']} updates in {results['seconds']:.2f}s, {results['throughput']:.1f} updates/s")
+
+        self.stdout.write(f"\n{'timed':<42}{'calls':>8}{'p50 (ms)':>11}{'p99 (ms)':>11}{'max (ms)':>11}")
+        for name, calls, p50, p99, slowest in results["rows"]:
+            self.stdout.write(f"{name:<42}{calls:>8}{p50:>11.2f}{p99:>11.2f}{slowest:>11.2f}")
+
+        queries = results["queries"]
+        if queries:
+            self.stdout.write(f"\nqueries per update: mean {queries['mean']:.2f}, p50 {queries['p50']}, p99 {queries['p99']}, max {queries['max']}")
+        for name, count in sorted(results["errors"].items()):
+            self.stdout.write(self.style.ERROR(f"{name}: {count}"))
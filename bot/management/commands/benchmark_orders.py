@@ -0,0 +1,110 @@
+import copy
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot.models import DeliveryDate, Order
+
+
+HALLS = ["Paul", "Joseph", "Peter", "John", "Daniel", "Mary", "Lydia", "Deborah", "Dorcas", "Esther"]
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway database with synthetic orders and time the bot's order lookups with and without the Order indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=100000, help="Number of synthetic orders to create")
+        parser.add_argument("--users", type=int, default=5000, help="Number of distinct telegram users the orders belong to")
+        parser.add_argument("--repeat", type=int, default=50, help="Times each lookup is run")
+
+    def handle(self, *args, **options):
+        # everything happens in a test database so real orders are never touched
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(options["orders"], options["users"])
+            self.stdout.write(f"Seeded {options['orders']} orders for {options['users']} users")
+
+            lookups = self.lookups(options["users"])
+            with_indexes = self.time_lookups(lookups, options["repeat"])
+
+            with connection.schema_editor() as editor:
+                # the delivery date foreign key's own index goes first, sqlite rebuilds the table to drop it
+                field = Order._meta.get_field("delivery_date")
+                unindexed = copy.copy(field)
+                unindexed.db_index = False
+                editor.alter_field(Order, field, unindexed)
+                for index in Order._meta.indexes:
+                    editor.remove_index(Order, index)
+                # the one cart per user constraint is a partial unique index on (user_id) of unpayed orders,
+                # the cart lookup would still use it
+                for constraint in Order._meta.constraints:
+                    editor.remove_constraint(Order, constraint)
+            self.analyze()
+            without_indexes = self.time_lookups(lookups, options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"\n{'lookup':<34}{'no indexes (ms)':>18}{'indexes (ms)':>16}{'speedup':>10}")
+        for name in lookups:
+            before, after = without_indexes[name], with_indexes[name]
+            self.stdout.write(f"{name:<34}{before:>18.3f}{after:>16.3f}{before / after:>9.1f}x")
+
+    def seed(self, order_count, user_count, batch_size=5000):
+        delivery_dates = DeliveryDate.objects.bulk_create(
+            DeliveryDate(date=datetime.date(2025, 1, 1) + datetime.timedelta(weeks=week)) for week in range(10)
+        )
+        rng = random.Random(0)
+        # a user has one cart at most, their other orders are payed
+        with_cart = set()
+
+        def order():
+            user_id = rng.randrange(user_count)
+            payed = rng.random() < 0.7 or user_id in with_cart
+            if not payed:
+                with_cart.add(user_id)
+            return Order(
+                user_id=user_id,
+                username="bench",
+                full_name="Bench User",
+                hall=rng.choice(HALLS),
+                room_no="A204",
+                payed=payed,
+                delivered=rng.random() < 0.5,
+                delivery_date=rng.choice(delivery_dates),
+            )
+
+        for start in range(0, order_count, batch_size):
+            Order.objects.bulk_create(order() for _ in range(min(batch_size, order_count - start)))
+        self.analyze()
+
+    def analyze(self):
+        # refresh planner statistics so the timings reflect the current indexes
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def lookups(self, user_count):
+        rng = random.Random(1)
+        delivery_date = DeliveryDate.objects.order_by("-id").first()
+
+        return {
+            "cart (user, unpayed)": lambda: list(Order.objects.filter(user_id=rng.randrange(user_count), payed=False)),
+            "/payed (user, payed)": lambda: list(Order.objects.filter(user_id=rng.randrange(user_count), payed=True)),
+            "admin (payed, undelivered, hall)": lambda: Order.objects.filter(payed=True, delivered=False, hall=rng.choice(HALLS)).count(),
+            "delivery date": lambda: Order.objects.filter(delivery_date=delivery_date).count(),
+        }
+
+    def time_lookups(self, lookups, repeat):
+        timings = {}
+        for name, lookup in lookups.items():
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                lookup()
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[name] = statistics.median(samples)
+        return timings
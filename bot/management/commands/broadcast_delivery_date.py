@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.broadcast import delivery_date_message, run_broadcast
+from bot.models import Broadcast, DeliveryDate
+
+
+class Command(BaseCommand):
+    help = "Tell every buyer with a payed, undelivered order the current delivery date"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resume", type=int, metavar="BROADCAST_ID", help="Continue an interrupted broadcast from its last checkpoint")
+        parser.add_argument("--message", help="Send this text instead of the delivery date notice")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Users messaged between checkpoints")
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            try:
+                broadcast = Broadcast.objects.get(id=options["resume"])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"Broadcast #{options['resume']} does not exist")
+            if broadcast.completed_at:
+                raise CommandError(f"{broadcast} already completed")
+        else:
+            message = options["message"]
+            if not message:
+                delivery_date = DeliveryDate.objects.order_by("-id").first()
+                if delivery_date is None:
+                    raise CommandError("There is no delivery date to announce")
+                message = delivery_date_message(delivery_date)
+            broadcast = Broadcast.objects.create(message=message)
+
+        self.stdout.write(f"Sending {broadcast}, resume it with --resume {broadcast.id} if interrupted")
+        run_broadcast(broadcast, chunk_size=options["chunk_size"], progress=self.report)
+
+    def report(self, broadcast):
+        status = "done" if broadcast.completed_at else "in progress"
+        self.stdout.write(f"{broadcast} {status}: {broadcast.sent_count} sent, {broadcast.failed_count} failed")
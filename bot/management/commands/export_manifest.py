@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from bot.manifest import manifest_lines
+
+
+class Command(BaseCommand):
+    help = "Write the per hall delivery manifest of the current delivery date"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", help="Write to this file instead of stdout")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Orders loaded from the database at a time")
+
+    def handle(self, *args, **options):
+        lines = manifest_lines(chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                output.writelines(lines)
+            self.stdout.write(f"Manifest written to {options['output']}")
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot.sales import rebuild_product_sales
+
+
+class Command(BaseCommand):
+    help = "Recompute the product sales table the admin reads from, from every order item"
+
+    def handle(self, *args, **options):
+        count = rebuild_product_sales()
+        self.stdout.write(f"Rebuilt {count} product sales rows")
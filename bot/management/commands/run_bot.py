@@ -1,9 +1,30 @@
-from django.core.management.base import BaseCommand
-from bot.bot import start_bot
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from bot import metrics
+from bot.bot import start_bot, set_webhook
 
 class Command(BaseCommand):
     help = "Run the Telegram bot"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--webhook",
+            action="store_true",
+            help="Register the webhook url with telegram and exit, updates are then handled by the web process",
+        )
+
     def handle(self, *args, **kwargs):
+        if kwargs["webhook"]:
+            try:
+                webhook_url = set_webhook()
+            except ImproperlyConfigured as e:
+                raise CommandError(e)
+            self.stdout.write(f"Telegram webhook set to {webhook_url}")
+            return
+
         self.stdout.write("Starting the Telegram bot...")
+        if settings.METRICS_LOG_INTERVAL:
+            # handler latencies, queries per update and error counts of this process, see bot/metrics.py
+            metrics.report_every(settings.METRICS_LOG_INTERVAL, self.stdout.write)
         start_bot()
@@ -0,0 +1,65 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from bot.models import DeliveryDate, Order
+
+
+
+def manifest_orders(delivery_date, chunk_size=500):
+    """
+    Streams the payed, undelivered orders of a delivery date sorted by hall then room,
+    with their items loaded chunk_size orders at a time.
+    """
+    orders = Order.objects.filter(payed=True, delivered=False, delivery_date=delivery_date)
+    return orders.with_items().order_by("hall", "room_no", "id").iterator(chunk_size=chunk_size)
+
+
+def hall_totals(hall, orders, cartons):
+    return f"-- {hall} Hall: {orders} orders, {cartons} cartons --\n\n"
+
+
+def manifest_lines(delivery_date=None, chunk_size=500):
+    """
+    Yields the runners' delivery manifest line by line: one block per hall, one line per order.
+    Only the current chunk of orders is held in memory however many there are.
+    """
+    if delivery_date is None:
+        delivery_date = DeliveryDate.objects.order_by("-id").first()
+    if delivery_date is None:
+        yield "There is no delivery date yet.\n"
+        return
+
+    yield f"Delivery manifest for {delivery_date}\n\n"
+
+    hall = None
+    hall_orders = hall_cartons = 0
+    for order in manifest_orders(delivery_date, chunk_size):
+        if order.hall != hall:
+            if hall is not None:
+                yield hall_totals(hall, hall_orders, hall_cartons)
+            hall = order.hall
+            hall_orders = hall_cartons = 0
+            yield f"== {hall} Hall ==\n"
+
+        items = order.orderitem_set.all()
+        item_list = ", ".join(f"{item.quantity} x {item.product.title}" for item in items)
+        hall_orders += 1
+        hall_cartons += sum(item.quantity for item in items)
+        yield f"Room {order.room_no} | {order.full_name} (@{order.username}) | Order #{order.id} | {item_list}\n"
+
+    if hall is None:
+        yield "No payed orders are waiting for delivery.\n"
+    else:
+        yield hall_totals(hall, hall_orders, hall_cartons)
+
+
+async def astream(lines, block_size=200):
+    """
+    Serves a sync line generator to an async response block_size lines at a time, so under asgi the download
+    starts straight away instead of after django has buffered the whole iterator in a worker thread.
+    """
+    lines = iter(lines)
+    next_block = sync_to_async(lambda: "".join(islice(lines, block_size)))
+    while block := await next_block():
+        yield block
@@ -0,0 +1,243 @@
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+# upper bounds of the histogram buckets, seconds for timings
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# for counts, e.g. db queries per update
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_latencies = {}
+# name -> every value observed, only kept while keep_samples is on
+_samples = None
+
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """
+    Records one observation of name, e.g. how long one call took, in a histogram with the given bucket bounds.
+    """
+    with _lock:
+        stats = _latencies.get(name)
+        if stats is None:
+            stats = _latencies[name] = {"count": 0, "total": 0.0, "max": 0.0, "buckets": dict.fromkeys(buckets, 0)}
+        stats["count"] += 1
+        stats["total"] += value
+        stats["max"] = max(stats["max"], value)
+        for bound in stats["buckets"]:
+            if value <= bound:
+                stats["buckets"][bound] += 1
+        if _samples is not None:
+            _samples.setdefault(name, []).append(value)
+
+
+@contextmanager
+def timed(name):
+    """
+    Times the wrapped block as name, and counts name.errors when it raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment(f"{name}.errors")
+        raise
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def instrumented(func, name=None):
+    """
+    Wraps func so each call is timed, as name or func's own name.
+    """
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "latencies": {name: {**stats, "buckets": dict(stats["buckets"])} for name, stats in _latencies.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _latencies.clear()
+        if _samples is not None:
+            _samples.clear()
+
+
+def keep_samples(enabled=True):
+    """
+    Keeps every observed value besides the histograms, for exact percentiles in benchmarks.
+    Off by default, the samples grow for as long as the process runs.
+    """
+    global _samples
+    with _lock:
+        _samples = {} if enabled else None
+
+
+def samples():
+    with _lock:
+        return {name: list(values) for name, values in (_samples or {}).items()}
+
+
+
+# ======================= REPORTING =======================
+
+# timings whose names start with these share one prometheus family, told apart by a label: (prefix, family, label)
+LABELLED_FAMILIES = [
+    ("handler.", "handler_duration_seconds", "handler"),
+    ("callback.", "callback_duration_seconds", "route"),
+    ("telegram.", "telegram_request_duration_seconds", "method"),
+    ("paystack.", "paystack_request_duration_seconds", "endpoint"),
+]
+# the family of the other histograms, ones not listed are named after the metric
+FAMILIES = {
+    "bot.update": "update_duration_seconds",
+    "bot.update.queries": "update_queries",
+    "outbox.wait": "outbox_wait_seconds",
+}
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _histogram_family(name, stats):
+    """
+    Returns the family and labels a histogram is rendered as, e.g. handler.get_product as
+    handler_duration_seconds{handler="get_product"}.
+    """
+    for prefix, family, label in LABELLED_FAMILIES:
+        if name.startswith(prefix):
+            return family, {label: name[len(prefix):]}
+    if name in FAMILIES:
+        return FAMILIES[name], {}
+    # timings are in seconds, other histograms count something
+    unit = "_seconds" if tuple(stats["buckets"]) == LATENCY_BUCKETS else ""
+    return _metric_name(name) + unit, {}
+
+
+def _labels(labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+
+
+def render_prometheus(prefix="indomie"):
+    """
+    Renders every metric in the prometheus text exposition format, histograms with their cumulative buckets.
+    Related metrics are one family with labels, e.g. indomie_handler_duration_seconds{handler="view_cart"}, and
+    every <name>.errors counter is indomie_errors_total{name="<name>"}.
+    """
+    data = snapshot()
+    families = {}  # family -> (type, [(labels, value or histogram stats)])
+
+    for name, value in data["counters"].items():
+        if name.endswith(".errors"):
+            family, labels = "errors_total", {"name": name[:-len(".errors")]}
+        else:
+            family, labels = _metric_name(name) + "_total", {}
+        families.setdefault(family, ("counter", []))[1].append((labels, value))
+
+    for name, value in data["gauges"].items():
+        families.setdefault(_metric_name(name), ("gauge", []))[1].append(({}, value))
+
+    for name, stats in data["latencies"].items():
+        family, labels = _histogram_family(name, stats)
+        families.setdefault(family, ("histogram", []))[1].append((labels, stats))
+
+    lines = []
+    for family, (kind, series) in sorted(families.items()):
+        metric = f"{prefix}_{family}"
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, value in sorted(series, key=lambda entry: sorted(entry[0].items())):
+            if kind != "histogram":
+                lines.append(f"{metric}{{{_labels(labels)}}} {value}" if labels else f"{metric} {value}")
+                continue
+            # observe() already counts each value in every bucket it fits, which is what prometheus expects
+            label_prefix = _labels(labels) + "," if labels else ""
+            for bound, count in value["buckets"].items():
+                lines.append(f'{metric}_bucket{{{label_prefix}le="{bound}"}} {count}')
+            series_labels = f"{{{_labels(labels)}}}" if labels else ""
+            lines += [
+                f'{metric}_bucket{{{label_prefix}le="+Inf"}} {value["count"]}',
+                f"{metric}_sum{series_labels} {value['total']}",
+                f"{metric}_count{series_labels} {value['count']}",
+            ]
+
+    return "\n".join(lines) + "\n"
+
+
+def percentile(stats, fraction):
+    """
+    Estimates a percentile of a histogram by interpolating inside the bucket it falls in, like prometheus'
+    histogram_quantile. Returns the largest value seen when it falls past the last bucket.
+    """
+    rank = fraction * stats["count"]
+    lower, below = 0, 0
+    for bound, count in stats["buckets"].items():
+        if count >= rank and count > below:
+            return min(lower + (bound - lower) * (rank - below) / (count - below), stats["max"])
+        lower, below = bound, count
+    return stats["max"]
+
+
+def summary():
+    """
+    One line per histogram with its count, mean, p99 and max, then the counters, for logging.
+    """
+    data = snapshot()
+    lines = []
+    for name, stats in sorted(data["latencies"].items()):
+        if not stats["count"]:
+            continue
+        lines.append(
+            f"{name}: n={stats['count']} mean={stats['total'] / stats['count']:.4g}"
+            f" p99={percentile(stats, 0.99):.4g} max={stats['max']:.4g}"
+        )
+    if data["counters"]:
+        lines.append(" ".join(f"{name}={value}" for name, value in sorted(data["counters"].items())))
+    return "\n".join(lines)
+
+
+def report_every(interval, write):
+    """
+    Calls write with the summary every interval seconds on a daemon thread. Returns an event that stops it when set.
+    """
+    stopped = threading.Event()
+
+    def report():
+        while not stopped.wait(interval):
+            text = summary()
+            if text:
+                write(text)
+
+    threading.Thread(target=report, name="metrics-report", daemon=True).start()
+    return stopped
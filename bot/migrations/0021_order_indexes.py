@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0020_conversationstate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', 'payed'], name='order_user_payed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payed', 'delivered', 'hall'], name='order_payed_delivered_hall_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_product_sales(apps, schema_editor):
+    OrderItem = apps.get_model("bot", "OrderItem")
+    ProductSales = apps.get_model("bot", "ProductSales")
+
+    paid = Q(order__payed=True)
+    totals = OrderItem.objects.values("product_id", "order__delivery_date_id").annotate(
+        paid_cartons=Coalesce(Sum("quantity", filter=paid), 0),
+        revenue=Coalesce(Sum(F("quantity") * F("product__price"), filter=paid), 0),
+        pending_cartons=Coalesce(Sum("quantity", filter=~paid), 0),
+    ).order_by()
+    ProductSales.objects.bulk_create(
+        [
+            ProductSales(
+                product_id=row["product_id"],
+                delivery_date_id=row["order__delivery_date_id"],
+                paid_cartons=row["paid_cartons"],
+                revenue=row["revenue"],
+                pending_cartons=row["pending_cartons"],
+            )
+            for row in totals
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0023_broadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid_cartons', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('pending_cartons', models.IntegerField(default=0)),
+                ('delivery_date', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='bot.deliverydate')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='bot.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product sales',
+                'constraints': [models.UniqueConstraint(fields=('product', 'delivery_date'), name='product_sales_product_delivery_date_unique')],
+            },
+        ),
+        migrations.RunPython(fill_product_sales, migrations.RunPython.noop),
+    ]
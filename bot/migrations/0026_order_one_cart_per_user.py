@@ -0,0 +1,52 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:14
+
+import importlib
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_open_orders(apps, schema_editor):
+    """
+    Moves the items of every user's unpayed orders into their newest one, which becomes their cart.
+    """
+    Order = apps.get_model("bot", "Order")
+    OrderItem = apps.get_model("bot", "OrderItem")
+    ProductSales = apps.get_model("bot", "ProductSales")
+
+    user_ids = list(
+        Order.objects.filter(payed=False).values("user_id").annotate(orders=Count("id"))
+        .filter(orders__gt=1).values_list("user_id", flat=True)
+    )
+    for user_id in user_ids:
+        cart, *others = Order.objects.filter(user_id=user_id, payed=False).order_by("-id")
+        for item in OrderItem.objects.filter(order__in=others):
+            existing = OrderItem.objects.filter(order=cart, product_id=item.product_id).first()
+            if existing:
+                existing.quantity += item.quantity
+                existing.save()
+                item.delete()
+            else:
+                item.order = cart
+                item.save()
+        Order.objects.filter(id__in=[order.id for order in others]).delete()
+
+    if user_ids:
+        # pending cartons may have moved delivery date
+        ProductSales.objects.all().delete()
+        importlib.import_module("bot.migrations.0024_productsales").fill_product_sales(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0025_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('payed', False)), fields=('user_id',), name='order_one_cart_per_user'),
+        ),
+    ]
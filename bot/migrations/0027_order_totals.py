@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    """
+    Prices existing items at their product's current price and totals every order from them.
+    """
+    Order = apps.get_model("bot", "Order")
+    OrderItem = apps.get_model("bot", "OrderItem")
+    Product = apps.get_model("bot", "Product")
+
+    OrderItem.objects.update(unit_price=Subquery(Product.objects.filter(id=OuterRef("product_id")).values("price")))
+    subtotal = Subquery(
+        OrderItem.objects.filter(order=OuterRef("pk")).values("order")
+        .annotate(amount=Sum(F("quantity") * F("unit_price"))).values("amount")
+    )
+    Order.objects.update(subtotal=Coalesce(subtotal, 0), total=Coalesce(subtotal, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0026_order_one_cart_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.IntegerField(blank=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0028_pendingstep'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MismatchedPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=255, unique=True)),
+                ('amount', models.IntegerField(help_text='In kobo')),
+                ('reason', models.CharField(max_length=255)),
+                ('charge', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved', models.BooleanField(default=False, help_text='Refunded or honoured')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot.order')),
+            ],
+        ),
+    ]
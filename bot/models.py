@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
@@ -32,6 +34,28 @@ class DeliveryDate(models.Model):
     
 
 
+class OrderQuerySet(models.QuerySet):
+
+    def with_items(self):
+        """
+        Loads the delivery date, items and their products alongside the orders, in two queries however many there are.
+        """
+        return self.select_related("delivery_date").prefetch_related(
+            models.Prefetch("orderitem_set", queryset=OrderItem.objects.select_related("product"))
+        )
+
+    def update_totals(self):
+        """
+        Recomputes the subtotal and total of the orders from their items' prices at purchase, in one UPDATE.
+        """
+        subtotal = Subquery(
+            OrderItem.objects.filter(order=OuterRef("pk")).values("order")
+            .annotate(amount=Sum(F("quantity") * F("unit_price"))).values("amount")
+        )
+        return self.update(subtotal=Coalesce(subtotal, 0), total=Coalesce(subtotal, 0))
+
+
+
 class Order(models.Model):
     user_id = models.BigIntegerField()
     username = models.CharField(max_length=255)
@@ -42,6 +66,31 @@ class Order(models.Model):
     payed = models.BooleanField(default=False)
     delivered = models.BooleanField(default=False)
     delivery_date = models.ForeignKey(DeliveryDate, on_delete=models.PROTECT, null=True, default=True)
+    # the latest paystack checkout link, reused on repeat checkouts of the same amount until it expires
+    payment_url = models.URLField(max_length=255, null=True, blank=True)
+    payment_reference = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    payment_amount = models.IntegerField(null=True, blank=True)
+    payment_expires_at = models.DateTimeField(null=True, blank=True)
+    # sum of the items' quantity * unit_price, kept up to date by bot/signals.py. total is what paystack charges,
+    # the same as subtotal until there are fees or discounts
+    subtotal = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    # bumped by save() and by bot/order_details.py when the order's items, products or delivery date change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the bot's cart, checkout and /payed lookups
+            models.Index(fields=["user_id", "payed"], name="order_user_payed_idx"),
+            # the admin's payed / delivered / hall filters
+            models.Index(fields=["payed", "delivered", "hall"], name="order_payed_delivered_hall_idx"),
+        ]
+        constraints = [
+            # a user's unpayed order is their cart, see bot/cart.py
+            models.UniqueConstraint(fields=["user_id"], condition=models.Q(payed=False), name="order_one_cart_per_user"),
+        ]
 
     def __str__(self):
         return f"Order #{self.id}"
@@ -57,9 +106,16 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     quantity = models.IntegerField()
+    # the product's price when it was added, payed orders keep it when the product's price changes
+    unit_price = models.IntegerField(blank=True)
 
     def __str__(self):
         return f"Product: {self.product.title}, Quantity: {self.quantity}, Order ID: {self.order.id}"
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+        super().save(*args, **kwargs)
     
 
 class Reciept(models.Model):
@@ -68,3 +124,86 @@ class Reciept(models.Model):
     reference = models.CharField(max_length=255)
 
 
+
+class MismatchedPayment(models.Model):
+    """
+    A successful paystack charge that didn't pay for its order, e.g. an old checkout link paid after the cart grew.
+    The money was taken, so it's kept for an admin to honour or refund.
+    """
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
+    reference = models.CharField(max_length=255, unique=True)
+    amount = models.IntegerField(help_text="In kobo")
+    reason = models.CharField(max_length=255)
+    charge = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved = models.BooleanField(default=False, help_text="Refunded or honoured")
+
+    def __str__(self):
+        return f"Payment {self.reference}"
+
+
+
+class ConversationState(models.Model):
+    """
+    An order a user is still filling in through the bot, used by the database state store.
+    """
+    user_id = models.BigIntegerField(unique=True)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"State for user {self.user_id}"
+
+
+
+class PendingStep(models.Model):
+    """
+    The bot handlers waiting for a chat's next message, used instead of telebot's in-memory next step handlers
+    by the database state store.
+    """
+    chat_id = models.BigIntegerField(unique=True)
+    handlers = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Next step for chat {self.chat_id}"
+
+
+
+class Broadcast(models.Model):
+    """
+    A message sent to every buyer with a payed, undelivered order.
+    Buyers are messaged in user_id order and last_user_id is checkpointed after every chunk so an interrupted broadcast can resume.
+    """
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    last_user_id = models.BigIntegerField(null=True, blank=True)
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Broadcast #{self.id}"
+
+
+
+class ProductSales(models.Model):
+    """
+    Cartons sold and pending per product and delivery date, kept up to date by bot/sales.py
+    so the admin doesn't have to sum every order item on each page load.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales")
+    delivery_date = models.ForeignKey(DeliveryDate, on_delete=models.CASCADE, null=True, blank=True)
+    paid_cartons = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+    pending_cartons = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "product sales"
+        constraints = [
+            models.UniqueConstraint(fields=["product", "delivery_date"], name="product_sales_product_delivery_date_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.product.title} - {self.delivery_date}"
+
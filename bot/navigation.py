@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup
+
+from bot import metrics
+
+
+# how many of the bot's messages to remember the content of, for the unchanged check
+MAX_RENDERED = 5000
+
+_lock = threading.Lock()
+_rendered = OrderedDict()  # (chat_id, message_id) -> (text, serialized markup)
+
+
+
+def remember(chat_id, message_id, content):
+    with _lock:
+        _rendered[(chat_id, message_id)] = content
+        _rendered.move_to_end((chat_id, message_id))
+        while len(_rendered) > MAX_RENDERED:
+            _rendered.popitem(last=False)
+
+
+def rendered(chat_id, message_id):
+    """
+    Returns the (text, markup) the bot last showed in a message, None if it isn't remembered.
+    """
+    with _lock:
+        return _rendered.get((chat_id, message_id))
+
+
+def forget_all():
+    with _lock:
+        _rendered.clear()
+
+
+def show_screen(message, text, markup=None, edit=False, parse_mode="Markdown"):
+    """
+    Shows text and markup in message's chat, replacing message itself when edit is true (message is then the bot's
+    own message, the one holding the tapped button) instead of sending another message.
+
+    Edits are skipped when the message already shows the same text and markup, and only the keyboard is edited when
+    only it changed. An edit telegram refuses (e.g. the message is too old) falls back to sending a new message.
+    Returns a Future of the api call's result, already resolved when nothing had to be sent.
+    """
+    # imported here, bot.bot imports this module
+    from bot.bot import outbox
+
+    if isinstance(markup, InlineKeyboardMarkup):
+        markup = markup.to_json()
+    chat_id = message.chat.id
+    content = (text, markup)
+
+    if not edit:
+        future = outbox.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=markup)
+        future.add_done_callback(lambda f: _remember_sent(chat_id, content, f))
+        return future
+
+    previous = rendered(chat_id, message.message_id)
+    if previous == content:
+        metrics.increment("navigation.unchanged")
+        future = Future()
+        future.set_result(None)
+        return future
+
+    if previous is not None and previous[0] == text:
+        metrics.increment("navigation.markup_edits")
+        future = outbox.edit_message_reply_markup(chat_id, message.message_id, reply_markup=markup)
+    else:
+        metrics.increment("navigation.edits")
+        future = outbox.edit_message_text(text, chat_id, message.message_id, parse_mode=parse_mode, reply_markup=markup)
+    remember(chat_id, message.message_id, content)
+
+    result = Future()
+
+    def resolved(f):
+        error = f.exception()
+        if error is None:
+            result.set_result(f.result())
+        elif isinstance(error, ApiTelegramException) and "not modified" in str(error.description):
+            # it already showed this, we just didn't know
+            result.set_result(None)
+        else:
+            with _lock:
+                _rendered.pop((chat_id, message.message_id), None)
+            metrics.increment("navigation.edit_fallbacks")
+            sent = outbox.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=markup)
+            sent.add_done_callback(lambda s: _remember_sent(chat_id, content, s))
+            sent.add_done_callback(lambda s: _copy_result(s, result))
+
+    future.add_done_callback(resolved)
+    return result
+
+
+def _remember_sent(chat_id, content, future):
+    if future.exception() is None and getattr(future.result(), "message_id", None) is not None:
+        remember(chat_id, future.result().message_id, content)
+
+
+def _copy_result(source, target):
+    if source.exception() is None:
+        target.set_result(source.result())
+    else:
+        target.set_exception(source.exception())
@@ -0,0 +1,20 @@
+def send_message(chat_id, text, **kwargs):
+    """
+    Queues a message on the bot's outbox, the caller doesn't wait for telegram.
+    """
+    # imported here, bot.bot imports the modules that send notifications
+    from bot.bot import outbox
+
+    return outbox.send_message(chat_id, text, **kwargs)
+
+
+def notify_order_paid(order):
+    """
+    Queues a telegram message telling the buyer their payment for order went through.
+    """
+    msg = (
+        f"*✅ Payment received for Order #{order.id}!* 🎉\n"
+        f"Your Indomie will be delivered to *{order.hall} Hall*, room *{order.room_no}* on the delivery date. 🚚🍜\n"
+        "Use /payed to see your receipt. 🎫"
+    )
+    send_message(order.user_id, msg, parse_mode="Markdown")
@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from bot.models import Order
+
+
+CACHE_KEY = "bot:order-details:{}"
+
+
+
+def build_order_details(order_id):
+    """
+    Renders the json the payment success page fetches for an order, with its etag and last modified time.
+    Returns None if the order doesn't exist.
+    """
+    order = Order.objects.with_items().filter(id=order_id).first()
+    if order is None:
+        return None
+
+    data = {
+        "delivery_date": f"{order.delivery_date}",
+        "id": order.id,
+        "full_name": order.full_name,
+        "hall": order.hall,
+        "room_no": order.room_no,
+        "items": [{"product": {"title": item.product.title}, "quantity": item.quantity} for item in order.orderitem_set.all()],
+    }
+    body = json.dumps(data)
+    return {
+        "body": body,
+        "etag": hashlib.md5(body.encode()).hexdigest(),
+        "last_modified": order.updated_at,
+    }
+
+
+def get_order_details(order_id):
+    """
+    Returns the rendered details of an order from the cache, building them on a miss. Missing orders aren't cached.
+    """
+    cache = caches[settings.ORDER_DETAILS_CACHE]
+    key = CACHE_KEY.format(order_id)
+    details = cache.get(key)
+    if details is None:
+        details = build_order_details(order_id)
+        if details is not None:
+            cache.set(key, details, timeout=settings.ORDER_DETAILS_CACHE_TTL)
+    return details
+
+
+def invalidate(order_ids):
+    caches[settings.ORDER_DETAILS_CACHE].delete_many([CACHE_KEY.format(order_id) for order_id in order_ids])
+
+
+def touch_orders(orders, chunk_size=1000):
+    """
+    Bumps updated_at and drops the cached details of every order in a queryset,
+    for changes that don't go through Order.save() (items, product titles, delivery dates, bulk updates).
+    """
+    order_ids = list(orders.values_list("id", flat=True))
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        Order.objects.filter(id__in=chunk).update(updated_at=timezone.now())
+        invalidate(chunk)
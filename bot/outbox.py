@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+from bot import metrics
+
+
+logger = logging.getLogger(__name__)
+
+THROTTLED = object()
+
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, and bursts of up to capacity calls.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """
+        Seconds until a token is available, 0 if one is available now.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+
+class OutboxItem:
+
+    def __init__(self, chat_id, method, args, kwargs):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+
+class Outbox:
+    """
+    Sends telegram api calls from a background thread, within telegram's rate limits.
+
+    Calls are throttled by a global token bucket and one bucket per chat, and each chat's calls go out
+    in the order they were queued. When telegram answers 429 the chat is paused for the retry_after it asks for
+    and the call is retried. Every queued call returns a Future of the api's result.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, batch_size=30, max_attempts=5, scan_limit=1000):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # how far past throttled chats the worker looks for calls it can send
+        self.scan_limit = scan_limit
+
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.chat_buckets = {}
+        # chat_id -> monotonic time telegram told us to wait until
+        self.paused_until = {}
+        self.in_flight = 0
+        self.thread = None
+
+    # ======================= QUEUEING =======================
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.call(chat_id, "send_message", chat_id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self.call(chat_id, "edit_message_text", text, chat_id, message_id, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id, message_id, **kwargs):
+        return self.call(chat_id, "edit_message_reply_markup", chat_id, message_id, **kwargs)
+
+    def call(self, chat_id, method, *args, **kwargs):
+        """
+        Queues bot.<method>(*args, **kwargs) for a chat and returns a Future of its result.
+        """
+        item = OutboxItem(chat_id, method, args, kwargs)
+        with self.cond:
+            self.queue.append(item)
+            metrics.set_gauge("outbox.queue_depth", len(self.queue))
+            self._ensure_worker()
+            self.cond.notify_all()
+        return item.future
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued call has been sent, returns False if timeout ran out first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.queue or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def _ensure_worker(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._work, name="outbox", daemon=True)
+            self.thread.start()
+
+    # ======================= SENDING =======================
+
+    def _work(self):
+        while True:
+            with self.cond:
+                batch, wait = self._next_batch()
+                while not batch:
+                    self.cond.wait(wait)
+                    batch, wait = self._next_batch()
+                self.in_flight = len(batch)
+                metrics.set_gauge("outbox.queue_depth", len(self.queue))
+
+            # calls telegram throttled, plus the calls behind them for the same chat
+            deferred = []
+            throttled_chats = set()
+            for item in batch:
+                if item.chat_id in throttled_chats or self._send(item) is THROTTLED:
+                    throttled_chats.add(item.chat_id)
+                    deferred.append(item)
+
+            with self.cond:
+                # back to the front so they still go out before the chats' later calls
+                self.queue.extendleft(reversed(deferred))
+                self.in_flight = 0
+                self.cond.notify_all()
+
+    def _next_batch(self):
+        """
+        Takes up to batch_size calls that may be sent now off the queue.
+        Returns the batch and, when it's empty, how long to wait before looking again (None for no calls queued).
+        """
+        now = time.monotonic()
+        batch = []
+        blocked_chats = set()
+        wait = None
+
+        for position, item in enumerate(self.queue):
+            if len(batch) >= self.batch_size or position >= self.scan_limit:
+                break
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                # nothing else can go out before the global bucket refills
+                wait = global_wait if wait is None else min(wait, global_wait)
+                break
+
+            # a chat's later calls can't overtake its earlier ones
+            if item.chat_id in blocked_chats:
+                continue
+
+            item_wait = max(
+                self.paused_until.get(item.chat_id, 0) - now,
+                self._chat_bucket(item.chat_id).wait_time(now),
+            )
+            if item_wait > 0:
+                blocked_chats.add(item.chat_id)
+                wait = item_wait if wait is None else min(wait, item_wait)
+                continue
+
+            self._chat_bucket(item.chat_id).take()
+            self.global_bucket.take()
+            batch.append(item)
+
+        for item in batch:
+            self.queue.remove(item)
+        self._prune(now)
+        return batch, wait
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self, now):
+        # a full bucket is the same as a new one, forget idle chats so this stays small
+        if len(self.chat_buckets) > 10000:
+            for chat_id, bucket in list(self.chat_buckets.items()):
+                bucket.refill(now)
+                if bucket.tokens >= bucket.capacity:
+                    del self.chat_buckets[chat_id]
+            for chat_id, until in list(self.paused_until.items()):
+                if until <= now:
+                    del self.paused_until[chat_id]
+
+    def _send(self, item):
+        """
+        Makes the api call of item and resolves its future, returns THROTTLED when it has to be retried later.
+        """
+        item.attempts += 1
+        metrics.observe("outbox.wait", time.monotonic() - item.enqueued_at)
+        try:
+            # timed as telegram.<method> by bot.dispatch.instrument_api_requests
+            result = getattr(self.bot, item.method)(*item.args, **item.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and item.attempts < self.max_attempts:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                metrics.increment("outbox.throttled")
+                with self.cond:
+                    self.paused_until[item.chat_id] = time.monotonic() + retry_after
+                return THROTTLED
+            logger.warning("Telegram %s to %s failed: %s", item.method, item.chat_id, e)
+            item.future.set_exception(e)
+        except Exception as e:
+            logger.warning("Telegram %s to %s failed: %s", item.method, item.chat_id, e)
+            item.future.set_exception(e)
+        else:
+            item.future.set_result(result)
@@ -0,0 +1,145 @@
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from bot import notifications, paystack
+from bot.models import MismatchedPayment, Order, Reciept
+
+
+logger = logging.getLogger(__name__)
+
+
+
+def get_payment_url(order_id, amount):
+    """
+    Returns a paystack checkout link for an unpayed order.
+
+    The link from an earlier checkout is reused while it's unexpired and for the same amount, so repeated
+    checkout taps start one paystack transaction instead of one per tap. Paystack is called without holding the
+    order's row lock, so carts and webhooks aren't blocked on it. If another checkout stored a usable link in the
+    meantime, that link wins and ours is dropped.
+    Returns None if paystack couldn't create the transaction, raises Order.DoesNotExist for payed or unknown orders.
+    """
+    order = Order.objects.get(id=order_id, payed=False)
+    if _reusable_link(order, amount):
+        return order.payment_url
+
+    reference = f"order-{order.id}-{uuid.uuid4().hex[:12]}"
+    callback_url = settings.WEBSITE_LINK.rstrip("/") + reverse("paystack_callback") + f"?order_id={order.id}"
+    try:
+        response_data = paystack.initialize_transaction(
+            amount,
+            email=order.email or "user_email@example.com",
+            callback_url=callback_url,
+            reference=reference,
+            metadata=json.dumps({"order_id": order.id}),
+        )
+    except paystack.PaystackError:
+        logger.exception("Couldn't start a paystack transaction for order #%s", order.id)
+        return None
+
+    if not response_data["status"]:
+        return None
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(id=order_id, payed=False)
+        if _reusable_link(order, amount):
+            return order.payment_url
+
+        order.payment_url = response_data["data"]["authorization_url"]
+        order.payment_reference = response_data["data"]["reference"]
+        order.payment_amount = amount
+        order.payment_expires_at = timezone.now() + timedelta(seconds=settings.PAYSTACK_LINK_TTL)
+        Order.objects.filter(id=order.id).update(
+            payment_url=order.payment_url,
+            payment_reference=order.payment_reference,
+            payment_amount=order.payment_amount,
+            payment_expires_at=order.payment_expires_at,
+        )
+    return order.payment_url
+
+
+def _reusable_link(order, amount):
+    return order.payment_url and order.payment_amount == amount and order.payment_expires_at > timezone.now()
+
+
+
+class PaymentMismatch(ValueError):
+    """
+    Raised for a successful paystack charge that isn't the payment of the order it's claimed for.
+    """
+
+
+
+def charge_order_id(charge):
+    """
+    Returns the order_id a paystack charge was started with in its metadata, or None.
+    """
+    metadata = charge.get("metadata") or {}
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return None
+    if not isinstance(metadata, dict):
+        return None
+    try:
+        return int(metadata.get("order_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def check_charge(order, charge):
+    """
+    Raises PaymentMismatch unless charge, paystack's data of a successful transaction, paid the order's current
+    total through the order's checkout link or a transaction started for the order.
+    """
+    if charge.get("amount") != order.total * 100:
+        raise PaymentMismatch(f"{charge.get('amount')} kobo paid for order #{order.id} of ₦{order.total}")
+    if charge.get("reference") != order.payment_reference and charge_order_id(charge) != order.id:
+        raise PaymentMismatch(f"transaction {charge.get('reference')} wasn't started for order #{order.id}")
+
+
+def mark_order_paid(order_id, trxref, charge):
+    """
+    Marks an order as payed by the paystack charge, records its receipt and lets the buyer know on telegram.
+    Calling it again for the same payment changes nothing and sends nothing.
+    Returns the order with its delivery date and items loaded. Raises Order.DoesNotExist for unknown orders and
+    PaymentMismatch, leaving the order unpayed and the charge recorded as a MismatchedPayment, when the charge
+    doesn't pay for it (see check_charge).
+    """
+    try:
+        with transaction.atomic():
+            # of=("self",), postgres can't lock the nullable side of the delivery date join
+            order = Order.objects.select_for_update(of=("self",)).with_items().get(id=order_id)
+            if not order.payed:
+                check_charge(order, charge)
+                order.payed = True  # modify payment status
+                order.save()
+                transaction.on_commit(lambda: notifications.notify_order_paid(order))
+
+            Reciept.objects.get_or_create(
+                order=order,
+                defaults={"trxref": trxref, "reference": charge["reference"]},
+            )
+    except PaymentMismatch as e:
+        record_mismatched_payment(order_id, charge, e)
+        raise
+    return order
+
+
+def record_mismatched_payment(order_id, charge, reason):
+    """
+    Keeps a charge that was taken but didn't pay for its order in the admin, once however often it's reported.
+    """
+    payment, created = MismatchedPayment.objects.get_or_create(
+        reference=charge["reference"],
+        defaults={"order_id": order_id, "amount": charge.get("amount") or 0, "reason": str(reason), "charge": charge},
+    )
+    return payment
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from bot import metrics
+
+
+_session = None
+_session_lock = threading.Lock()
+
+# event loop -> httpx.AsyncClient, an async client can only be used on the loop it was created on
+_async_clients = weakref.WeakKeyDictionary()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+
+class PaystackError(Exception):
+    """
+    Raised when paystack can't be reached or doesn't answer with json.
+    """
+
+
+
+def get_session():
+    """
+    Returns the shared session, its pooled keep-alive connections are reused by every paystack call in this process.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=settings.PAYSTACK_MAX_RETRIES,
+                backoff_factor=0.5,
+                # only GETs are retried on a bad status, a POST might have gone through.
+                # failed connects are retried for both since nothing was sent
+                allowed_methods=frozenset(["GET"]),
+                status_forcelist=RETRY_STATUSES,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.PAYSTACK_POOL_SIZE,
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_async_client():
+    """
+    Returns the async client of the running event loop, its connections are pooled like the session's.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.PAYSTACK_READ_TIMEOUT, connect=settings.PAYSTACK_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=settings.PAYSTACK_POOL_SIZE, max_keepalive_connections=settings.PAYSTACK_POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _metric_name(path):
+    # "/transaction/verify/<reference>" is recorded as "paystack.transaction.verify"
+    return "paystack" + ".".join(path.split("/")[:3])
+
+
+def request(method, path, **kwargs):
+    """
+    Sends a request to the paystack api and returns the decoded json body.
+    """
+    url = settings.PAYSTACK_BASE_URL.rstrip("/") + path
+    headers = {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}"}
+    timeout = (settings.PAYSTACK_CONNECT_TIMEOUT, settings.PAYSTACK_READ_TIMEOUT)
+
+    try:
+        with metrics.timed(_metric_name(path)):
+            response = get_session().request(method, url, headers=headers, timeout=timeout, **kwargs)
+            return response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise PaystackError(f"{method} {path} failed: {e}") from e
+
+
+def initialize_transaction(amount, email, callback_url, **extra):
+    """
+    Starts a transaction for amount naira and returns paystack's response.
+    """
+    data = {
+        "amount": amount * 100,  # Convert to kobo (Paystack expects the amount in kobo)
+        "email": email,
+        "callback_url": callback_url,
+        **extra,
+    }
+    return request("POST", "/transaction/initialize", data=data)
+
+
+def verify_transaction(reference):
+    return request("GET", f"/transaction/verify/{reference}")
+
+
+async def arequest(method, path, **kwargs):
+    """
+    Async version of request(), with the same retry policy: failed connects are retried for every
+    method, bad statuses for GETs only.
+    """
+    url = settings.PAYSTACK_BASE_URL.rstrip("/") + path
+    headers = {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}"}
+    client = get_async_client()
+
+    try:
+        with metrics.timed(_metric_name(path)):
+            for attempt in range(settings.PAYSTACK_MAX_RETRIES + 1):
+                retries_left = attempt < settings.PAYSTACK_MAX_RETRIES
+                try:
+                    response = await client.request(method, url, headers=headers, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if not retries_left:
+                        raise
+                else:
+                    if not (retries_left and method == "GET" and response.status_code in RETRY_STATUSES):
+                        return response.json()
+                await asyncio.sleep(0.5 * 2 ** attempt)
+    except (httpx.HTTPError, ValueError) as e:
+        raise PaystackError(f"{method} {path} failed: {e}") from e
+
+
+async def averify_transaction(reference):
+    return await arequest("GET", f"/transaction/verify/{reference}")
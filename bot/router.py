@@ -0,0 +1,137 @@
+import logging
+
+from bot import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# telegram rejects buttons with longer callback data
+MAX_CALLBACK_DATA = 64  # bytes
+
+VERSION = "1"
+SEPARATOR = ":"
+
+# payloads of buttons sent before callbacks were routed, users can still tap them in their chat history
+LEGACY_NAMES = {
+    "products": "products",
+    "help": "help",
+    "checkout_single_order": "checkout_cart",
+    "checkout_cart": "checkout_cart",
+    "remove_order_cart": "remove_item_cart",
+    "remove_item_cart": "remove_item_cart",
+}
+LEGACY_PREFIXES = [
+    ("process_checkout_", "process_checkout"),
+    ("remove_order_", "remove_order"),
+    ("remove_item_", "remove_item"),
+    ("payed_page_", "payed_page"),
+    ("product_", "product"),
+    ("order_", "order"),
+    ("hall_", "hall"),
+    ("help_", "help_page"),
+]
+
+
+
+class InvalidCallback(ValueError):
+    """
+    Raised for callback data no route accepts.
+    """
+
+
+
+def _parse_arg(arg_type, arg):
+    """
+    Converts one callback argument. Ids and pages are only ever plain non-negative numbers, int() alone would also
+    take "-1", " 5" or "1_000".
+    """
+    if arg_type is int and not (arg.isascii() and arg.isdigit()):
+        raise ValueError(f"not a non-negative integer: {arg!r}")
+    return arg_type(arg)
+
+
+def encode(route, *args):
+    """
+    Builds the callback data of a button for route, e.g. encode("order", 5) gives "1:order:5".
+    """
+    parts = [VERSION, route, *(str(arg) for arg in args)]
+    if any(SEPARATOR in part for part in parts):
+        raise ValueError(f"Callback arguments can't contain {SEPARATOR!r}: {parts}")
+    data = SEPARATOR.join(parts)
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"Callback data is longer than {MAX_CALLBACK_DATA} bytes: {data}")
+    return data
+
+
+
+class CallbackRouter:
+    """
+    Dispatches callback queries to handlers by a dict lookup on their route name, instead of testing every
+    handler's filter in turn. Each route declares the types of its arguments, data that doesn't parse is
+    rejected before any handler runs.
+    """
+
+    def __init__(self):
+        self.routes = {}  # name -> (handler, argument types)
+
+    def route(self, name, *arg_types):
+        """
+        Registers the decorated function for name, it's called with the callback query and the parsed arguments.
+        """
+        def decorator(handler):
+            self.routes[name] = (handler, arg_types)
+            return handler
+        return decorator
+
+    def parse(self, data):
+        """
+        Returns the route name and raw arguments of callback data, in the current or the legacy format.
+        """
+        if not data or len(data.encode()) > MAX_CALLBACK_DATA:
+            raise InvalidCallback("empty or oversized callback data")
+
+        version, separator, rest = data.partition(SEPARATOR)
+        if separator:
+            if version != VERSION:
+                raise InvalidCallback(f"unknown callback version {version}")
+            name, *args = rest.split(SEPARATOR)
+            return name, args
+
+        if data in LEGACY_NAMES:
+            return LEGACY_NAMES[data], []
+        for prefix, name in LEGACY_PREFIXES:
+            if data.startswith(prefix):
+                return name, [data[len(prefix):]]
+        raise InvalidCallback(f"unknown callback {data}")
+
+    def resolve(self, data):
+        """
+        Returns the handler and typed arguments for callback data, raises InvalidCallback if there's none.
+        """
+        name, args = self.parse(data)
+        try:
+            handler, arg_types = self.routes[name]
+        except KeyError:
+            raise InvalidCallback(f"no route for {name}")
+        if len(args) != len(arg_types):
+            raise InvalidCallback(f"{name} takes {len(arg_types)} arguments, got {len(args)}")
+        try:
+            return name, handler, [_parse_arg(arg_type, arg) for arg_type, arg in zip(arg_types, args)]
+        except ValueError:
+            raise InvalidCallback(f"bad arguments for {name}: {args}")
+
+    def dispatch(self, call):
+        """
+        Runs the handler for a callback query, timed as callback.<route>. Returns False if the data was rejected.
+        """
+        try:
+            name, handler, args = self.resolve(call.data)
+        except InvalidCallback as e:
+            metrics.increment("callback.rejected")
+            logger.warning("Rejected callback from %s: %s", call.from_user.id, e)
+            return False
+
+        with metrics.timed(f"callback.{name}"):
+            handler(call, *args)
+        return True
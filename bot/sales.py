@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from bot.models import OrderItem, Product, ProductSales
+
+
+
+def aggregate_sales(items):
+    """
+    Sums order items into unsaved ProductSales rows, one per product and delivery date.
+    """
+    paid = Q(order__payed=True)
+    totals = items.values("product_id", "order__delivery_date_id").annotate(
+        paid_cartons=Coalesce(Sum("quantity", filter=paid), 0),
+        revenue=Coalesce(Sum(F("quantity") * F("unit_price"), filter=paid), 0),
+        pending_cartons=Coalesce(Sum("quantity", filter=~paid), 0),
+    ).order_by()
+
+    return [
+        ProductSales(
+            product_id=row["product_id"],
+            delivery_date_id=row["order__delivery_date_id"],
+            paid_cartons=row["paid_cartons"],
+            revenue=row["revenue"],
+            pending_cartons=row["pending_cartons"],
+        )
+        for row in totals
+    ]
+
+
+def count_item(changes, product_id, delivery_date_id, payed, quantity, unit_price, sign=1):
+    """
+    Adds what an order item counts towards its product's sales to changes, a dict of
+    (product_id, delivery_date_id) -> [paid_cartons, revenue, pending_cartons]. A sign of -1 takes it away instead.
+    """
+    amounts = (quantity, quantity * unit_price, 0) if payed else (0, 0, quantity)
+    total = changes.setdefault((product_id, delivery_date_id), [0, 0, 0])
+    for i, amount in enumerate(amounts):
+        total[i] += sign * amount
+
+
+def apply_changes(changes):
+    for (product_id, delivery_date_id), amounts in changes.items():
+        add_sales(product_id, delivery_date_id, *amounts)
+
+
+def add_sales(product_id, delivery_date_id, paid_cartons=0, revenue=0, pending_cartons=0):
+    """
+    Adds to the sales row of a product and delivery date, negative amounts take away from it.
+    The amounts are added with F() in the database, so concurrent changes to the same row don't overwrite each other.
+    """
+    if not (paid_cartons or revenue or pending_cartons):
+        return
+
+    rows = ProductSales.objects.filter(product_id=product_id, delivery_date_id=delivery_date_id)
+    changes = {
+        "paid_cartons": F("paid_cartons") + paid_cartons,
+        "revenue": F("revenue") + revenue,
+        "pending_cartons": F("pending_cartons") + pending_cartons,
+    }
+    if rows.update(**changes):
+        return
+    # nothing to take away from, e.g. the product is being deleted along with its rows
+    if max(paid_cartons, revenue, pending_cartons) <= 0:
+        return
+    with transaction.atomic():
+        # the product's lock keeps two first sales on a date from both creating its row,
+        # the unique constraint can't since NULL delivery dates never conflict
+        if not list(Product.objects.select_for_update().filter(id=product_id).values_list("id", flat=True)):
+            return
+        if not rows.update(**changes):
+            ProductSales.objects.create(
+                product_id=product_id,
+                delivery_date_id=delivery_date_id,
+                paid_cartons=paid_cartons,
+                revenue=revenue,
+                pending_cartons=pending_cartons,
+            )
+
+
+def move_order_sales(order_id, previous, current):
+    """
+    Moves an order's items from the sales rows of its previous (delivery_date_id, payed) to those of its current one,
+    e.g. from pending to paid once it's payed.
+    """
+    changes = {}
+    items = OrderItem.objects.filter(order_id=order_id).values_list("product_id", "quantity", "unit_price")
+    for product_id, quantity, unit_price in items:
+        count_item(changes, product_id, *previous, quantity, unit_price, sign=-1)
+        count_item(changes, product_id, *current, quantity, unit_price)
+    apply_changes(changes)
+
+
+def rebuild_product_sales():
+    """
+    Recomputes the whole table from the order items.
+    """
+    with transaction.atomic():
+        ProductSales.objects.all().delete()
+        ProductSales.objects.bulk_create(aggregate_sales(OrderItem.objects.all()), batch_size=500)
+    return ProductSales.objects.count()
@@ -0,0 +1,121 @@
+from django.conf import settings
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.router import encode
+
+
+_screens = None
+
+
+
+def keyboard(*rows, row_width=3):
+    """
+    Builds a serialized inline keyboard from rows of (text, route, *args) buttons.
+    """
+    markup = InlineKeyboardMarkup(row_width=row_width)
+    for row in rows:
+        markup.add(*(InlineKeyboardButton(text, callback_data=encode(*route)) for text, *route in row))
+    return markup.to_json()
+
+
+def build_screens():
+    """
+    Renders the bot's static screens, each a dict with its msg and its markup as serialized json, which telebot sends as is.
+    """
+    halls = settings.BOT_HALLS
+    # how_to_order names a hall as its example
+    example_hall = halls[0] if halls else "Paul"
+
+    return {
+        "start": {
+            "msg": """
+🌟 Hey there! I’m the *CU Indomie Guy!* 🎉
+*----------------------------------------------------------------------*
+
+I’m here to make your _Indomie_ cravings super easy to satisfy! 🛒
+Whether it’s a carton (or more 👀), I’ll hook you up with premium-quality _Indomie_ straight from our trusted vendor.
+
+🚚 Delivery? No stress! Your order will land at your hall 🏠 within *7 days* max—guaranteed.
+
+👇 Tap one of the options below to see what magic we can cook up together! 🔥""",
+            "markup": keyboard([("Products", "products")], [("Help", "help")]),
+        },
+        "help": {
+            "msg": (
+                "*Help Section*\n"
+                "*----------------------------------------------------------------------*\n"
+                "👋 Hello, welcome to the help section! I'm here to guide you on how to use this bot to satisfy your Indomie cravings 🍜.\n"
+                "Click the button below to learn more about what I can do for you: 👇"
+            ),
+            "markup": keyboard([("📖 Continue Reading", "help_page", "intro")]),
+        },
+        "help_intro": {
+            "msg": (
+                "**#Intro**\n\n"
+                "So you're wondering what I'm about, right? 🤔\n\n"
+                "Simple! I'm a bot for ordering *Indomie* 🍜 from the convenience of your room. 🏠\n\n"
+                "All you have to do is place your order, and I'll forward it to my team to deliver straight to your hall within **7 days**. 🚀\n\n"
+                "Oh, and my name is **CU Indomie Guy**, just in case you missed it. 😊\n\n"
+                "Ready to see the commands? Tap below! 👇"
+            ),
+            "markup": keyboard([("🔙 Back", "help_page", "edit"), ("📜 View Commands", "help_page", "commands")]),
+        },
+        "help_commands": {
+            "msg": (
+                "*#Commands*\n\n"
+                "/start - 🍜 Hello! I'm CU Indomie Guy 😎 — Your one-stop shop for tasty Indomie!\n"
+                "/help - 🤔 Confused? No worries, click here to find out how I can help you!\n"
+                "/products - 🍴 Explore all the delicious Indomie options available.\n"
+                "/cart - 🛒 View your cart and ensure you're ready to munch.\n"
+                "/checkout - 💳 Settle up and get your orders delivered.\n"
+                "/payed - 💰 Check all your paid and confirmed orders.\n"
+                "Want to know how to place an order? Tap below! 👇"
+            ),
+            "markup": keyboard([("🔙 Back", "help_page", "intro"), ("📦 How to Place an Order", "help_page", "how_to_order")]),
+        },
+        "help_how_to_order": {
+            "msg": (
+                "**#How to Place an Order**\n\n"
+                "Here's how you can place an order in **7 easy steps**: 🛒\n\n"
+                "1️⃣ Click on /products and select a product.\n"
+                "2️⃣ Click on 'Add to Cart'. 🛍️\n"
+                "3️⃣ Enter the number of cartons you need (e.g., 1, 5). 🔢\n"
+                "4️⃣ Enter your email (e.g., `youremail@example.com`). 📧\n"
+                "5️⃣ Enter the full name of the recipient. 👤\n"
+                f"6️⃣ Choose the recipient's hall (e.g., {example_hall} Hall). 🏢\n"
+                "7️⃣ Enter the room number (e.g., A204). 🚪\n\n"
+                "Add more products the same way, you'll only be asked for steps 4️⃣ to 7️⃣ once per cart. 🛒\n"
+                "Use /cart to view your cart and /checkout to pay for all of it at once. Easy, right? 😉"
+            ),
+            "markup": keyboard([("🔙 Back", "help_page", "commands")]),
+        },
+        "halls": {
+            "msg": "🏠 *Where should we deliver your Indomie?* 🍜🚀 \nPlease select the hall for delivery: 👇",
+            # one button per hall, each sending its own name
+            "markup": keyboard([(f"{hall} Hall", "hall", hall) for hall in halls]),
+        },
+    }
+
+
+def get_screen(name):
+    """
+    Returns a prebuilt screen, or None if there's no screen called name. Screens are built on first use.
+    """
+    global _screens
+
+    if _screens is None:
+        _screens = build_screens()
+    return _screens.get(name)
+
+
+def is_hall(hall):
+    return hall in settings.BOT_HALLS
+
+
+def reload():
+    """
+    Rebuilds every screen, for when the settings they're built from change.
+    """
+    global _screens
+
+    _screens = build_screens()
@@ -0,0 +1,121 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from bot import catalogue, order_details, sales
+from bot.models import DeliveryDate, Order, OrderItem, Product
+
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalogue(sender, **kwargs):
+    """
+    Drops the cached product catalogue whenever a product is added, edited or deleted.
+    """
+    catalogue.invalidate()
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_fields(sender, instance, **kwargs):
+    instance._previous_fields = Product.objects.filter(id=instance.id).values("title", "price").first() if instance.id else None
+
+
+# ======================= ORDER TOTALS =======================
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    Order.objects.filter(id=instance.order_id).update_totals()
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created, **kwargs):
+    """
+    Carries a product's new price over to the carts holding it, payed orders keep the price they were payed at.
+    """
+    previous = getattr(instance, "_previous_fields", None)
+    if created or previous is None or previous["price"] == instance.price:
+        return
+    OrderItem.objects.filter(product=instance, order__payed=False).update(unit_price=instance.price)
+    Order.objects.filter(payed=False, orderitem__product=instance).update_totals()
+
+
+# ======================= PRODUCT SALES =======================
+
+@receiver(pre_save, sender=OrderItem)
+@receiver(pre_delete, sender=OrderItem)
+def remember_item_sales(sender, instance, **kwargs):
+    instance._previous_sales = OrderItem.objects.filter(id=instance.id).values_list(
+        "product_id", "order__delivery_date_id", "order__payed", "quantity", "unit_price"
+    ).first() if instance.id else None
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_item_sales(sender, instance, **kwargs):
+    """
+    Takes what the item counted towards its product's sales before the change away, and adds what it counts now.
+    """
+    changes = {}
+    previous = getattr(instance, "_previous_sales", None)
+    if previous is not None:
+        sales.count_item(changes, *previous, sign=-1)
+
+    if kwargs["signal"] is post_save:
+        order = Order.objects.filter(id=instance.order_id).values_list("delivery_date_id", "payed").first()
+        if order is not None:
+            sales.count_item(changes, instance.product_id, *order, instance.quantity, instance.unit_price)
+    sales.apply_changes(changes)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_sales_fields(sender, instance, **kwargs):
+    previous = Order.objects.filter(id=instance.id).values("payed", "delivery_date_id").first() if instance.id else None
+    instance._previous_sales_fields = previous
+
+
+@receiver(post_save, sender=Order)
+def update_order_sales(sender, instance, created, **kwargs):
+    """
+    Moves an order's items between pending and paid, or between delivery dates, when the order changes.
+    New orders have no items yet, their items are counted as they're added.
+    """
+    previous = getattr(instance, "_previous_sales_fields", None)
+    if created or previous is None:
+        return
+    if previous["payed"] == instance.payed and previous["delivery_date_id"] == instance.delivery_date_id:
+        return
+    sales.move_order_sales(
+        instance.id,
+        (previous["delivery_date_id"], previous["payed"]),
+        (instance.delivery_date_id, instance.payed),
+    )
+
+
+# ======================= ORDER DETAILS =======================
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order_details(sender, instance, **kwargs):
+    order_details.invalidate([instance.id])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def touch_item_order(sender, instance, **kwargs):
+    order_details.touch_orders(Order.objects.filter(id=instance.order_id))
+
+
+@receiver(post_save, sender=Product)
+def touch_product_orders(sender, instance, created, **kwargs):
+    # order details show product titles, prices changes don't affect them
+    previous = getattr(instance, "_previous_fields", None)
+    if not created and previous is not None and previous["title"] != instance.title:
+        order_details.touch_orders(Order.objects.filter(orderitem__product=instance).distinct())
+
+
+@receiver(post_save, sender=DeliveryDate)
+def touch_delivery_date_orders(sender, instance, created, **kwargs):
+    if not created:
+        order_details.touch_orders(Order.objects.filter(delivery_date=instance))
+
@@ -0,0 +1,164 @@
+import importlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from telebot import Handler
+from telebot.handler_backends import HandlerBackend
+
+from bot.dispatch import instrument_handler
+from bot.models import ConversationState, PendingStep
+
+
+
+class MemoryStateStore:
+    """
+    Keeps in-progress orders in process memory.
+
+    Entries expire ttl seconds after they were last written and the least recently used
+    entry is dropped once max_size is reached, so memory stays flat no matter how many users start an order.
+    """
+
+    def __init__(self, ttl=3600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # user_id -> (expires_at, data), oldest first
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id]
+                return None
+
+            self.entries.move_to_end(user_id)
+            return dict(data)
+
+    def set(self, user_id, data):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, dict(data))
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+
+class DatabaseStateStore:
+    """
+    Keeps in-progress orders in the ConversationState table so they survive restarts
+    and can be shared by several bot processes, along with DatabaseStepBackend for the step each order is at.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+
+    def get(self, user_id):
+        return ConversationState.objects.filter(
+            user_id=user_id,
+            updated_at__gte=self._expired_before(),
+        ).values_list("data", flat=True).first()
+
+    def set(self, user_id, data):
+        ConversationState.objects.update_or_create(user_id=user_id, defaults={"data": data})
+
+    def delete(self, user_id):
+        ConversationState.objects.filter(user_id=user_id).delete()
+        # clear out orders other users abandoned while we're at it
+        self.purge_expired()
+
+    def purge_expired(self):
+        return ConversationState.objects.filter(updated_at__lt=self._expired_before()).delete()[0]
+
+    def _expired_before(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+
+
+class DatabaseStepBackend(HandlerBackend):
+    """
+    Keeps the handlers waiting for a chat's next message in the PendingStep table instead of telebot's
+    in-memory backend, so an answer to a question asked before a restart, or by another process, still reaches
+    the step that asked it. Handlers are stored by import path, so they must be module level functions.
+    """
+
+    def __init__(self, ttl=3600):
+        super().__init__()
+        self.ttl = ttl
+
+    def register_handler(self, handler_group_id, handler):
+        callback = inspect.unwrap(handler.callback)
+        entry = {
+            "callback": f"{callback.__module__}:{callback.__qualname__}",
+            "args": list(handler.args),
+            "kwargs": handler.kwargs,
+        }
+        with transaction.atomic():
+            step, created = PendingStep.objects.select_for_update().get_or_create(chat_id=handler_group_id)
+            if not created and step.updated_at < self._expired_before():
+                step.handlers = []
+            step.handlers.append(entry)
+            step.save()
+        if created:
+            # clear out steps other chats abandoned while we're at it
+            self.purge_expired()
+
+    def clear_handlers(self, handler_group_id):
+        PendingStep.objects.filter(chat_id=handler_group_id).delete()
+
+    def get_handlers(self, handler_group_id):
+        # handlers only run once, whichever process gets the message takes them
+        with transaction.atomic():
+            step = PendingStep.objects.select_for_update().filter(chat_id=handler_group_id).first()
+            if step is None:
+                return None
+            step.delete()
+        if step.updated_at < self._expired_before():
+            return None
+        return [
+            Handler(self._resolve(entry["callback"]), *entry["args"], **entry["kwargs"])
+            for entry in step.handlers
+        ]
+
+    def purge_expired(self):
+        return PendingStep.objects.filter(updated_at__lt=self._expired_before()).delete()[0]
+
+    def _resolve(self, path):
+        module, name = path.split(":")
+        return instrument_handler(getattr(importlib.import_module(module), name))
+
+    def _expired_before(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+
+
+def get_state_store():
+    """
+    Builds the state store selected by the BOT_STATE_STORE setting.
+    """
+    if settings.BOT_STATE_STORE == "database":
+        return DatabaseStateStore(ttl=settings.BOT_STATE_TTL)
+    return MemoryStateStore(ttl=settings.BOT_STATE_TTL, max_size=settings.BOT_STATE_MAX_SIZE)
+
+
+def get_step_backend():
+    """
+    Builds the next step backend that goes with the BOT_STATE_STORE setting, None keeps telebot's in-memory one.
+    """
+    if settings.BOT_STATE_STORE == "database":
+        return DatabaseStepBackend(ttl=settings.BOT_STATE_TTL)
+    return None
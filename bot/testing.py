@@ -0,0 +1,257 @@
+"""
+Helpers for exercising the bot without the real telegram and paystack apis, used by the tests and benchmark_bot.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from telebot import apihelper
+
+
+
+def message_update(text, user_id=1001, update_id=1):
+    """
+    Builds a telegram update payload for a private chat text message, as telegram would send it.
+    """
+    payload = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1737700000,
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test", "username": "tester"},
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        payload["message"]["entities"] = [{"offset": 0, "length": len(text.split()[0]), "type": "bot_command"}]
+    return payload
+
+
+def callback_update(data, user_id=1001, update_id=1):
+    """
+    Builds a telegram update payload for an inline button tap.
+    """
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test", "username": "tester"},
+            "message": {
+                "message_id": update_id,
+                "date": 1737700000,
+                "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients giving up on a slow answer is expected, don't print their broken pipes
+        pass
+
+
+
+class PaystackStub:
+    """
+    A local http server answering the paystack endpoints the bot uses.
+
+    Point settings.PAYSTACK_BASE_URL at stub.url. Every request is recorded in stub.requests,
+    fail_next makes the next n requests answer 503 and delay slows every answer down.
+
+        with PaystackStub() as stub, override_settings(PAYSTACK_BASE_URL=stub.url):
+            ...
+    """
+
+    def __init__(self, verify_status="success", delay=0):
+        self.verify_status = verify_status
+        self.delay = delay
+        self.fail_next = 0
+        self.requests = []
+        # reference -> the body the transaction was initialized with
+        self.transactions = {}
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = QuietHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, method, path, body):
+        """
+        Returns the (status, payload) paystack would answer with.
+        """
+        with self.lock:
+            self.requests.append({"method": method, "path": path, "body": body})
+            if self.fail_next:
+                self.fail_next -= 1
+                return 503, {"status": False, "message": "Service unavailable"}
+
+        if method == "POST" and path == "/transaction/initialize":
+            reference = body.get("reference") or f"ref_{len(self.requests)}"
+            with self.lock:
+                self.transactions[reference] = body
+            return 200, {
+                "status": True,
+                "message": "Authorization URL created",
+                "data": {
+                    "authorization_url": f"https://checkout.paystack.com/{reference}",
+                    "access_code": f"access_{reference}",
+                    "reference": reference,
+                },
+            }
+
+        if method == "GET" and path.startswith("/transaction/verify/"):
+            reference = path.rsplit("/", 1)[1]
+            transaction = self.transactions.get(reference, {})
+            return 200, {
+                "status": True,
+                "message": "Verification successful",
+                "data": {
+                    "status": self.verify_status,
+                    "reference": reference,
+                    "amount": int(transaction.get("amount", 0)),
+                    "metadata": transaction.get("metadata", ""),
+                },
+            }
+
+        return 404, {"status": False, "message": "Not found"}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the real api
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                self._answer({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    body = json.loads(raw or "{}")
+                else:
+                    body = {key: values[0] for key, values in parse_qs(raw).items()}
+                self._answer(body)
+
+            def _answer(self, body):
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, payload = stub.respond(self.command, urlparse(self.path).path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+
+class StubResponse:
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self.reason = "OK"
+        self.text = json.dumps(payload)
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+
+class TelegramStub:
+    """
+    Answers the bot's telegram api calls in process, through telebot's apihelper.CUSTOM_REQUEST_SENDER.
+
+    Every call is recorded in stub.calls as (method, params), delay makes each call take that many seconds
+    like a round trip to telegram would.
+
+        with TelegramStub() as stub:
+            ...
+    """
+
+    # methods telegram answers with the message they sent or edited
+    MESSAGE_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup"}
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.previous_sender = None
+
+    def start(self):
+        self.previous_sender = apihelper.CUSTOM_REQUEST_SENDER
+        apihelper.CUSTOM_REQUEST_SENDER = self.send
+        return self
+
+    def stop(self):
+        apihelper.CUSTOM_REQUEST_SENDER = self.previous_sender
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def send(self, method, url, params=None, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        api_method = url.rsplit("/", 1)[1]
+        params = params or {}
+
+        with self.lock:
+            self.calls.append((api_method, params))
+            self.message_id += 1
+            message_id = self.message_id
+
+        if api_method.lower() not in self.MESSAGE_METHODS:
+            return StubResponse({"ok": True, "result": True})
+
+        chat_id = int(params.get("chat_id", 0))
+        return StubResponse({"ok": True, "result": {
+            "message_id": int(params.get("message_id") or message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }})
@@ -1,3 +1,1229 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import hmac
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from telebot import Handler
+from telebot.apihelper import ApiTelegramException
+from telebot.types import Update
+
+from bot import bot as handlers
+from bot import broadcast, cart, catalogue, loadtest, manifest, metrics, navigation, notifications, payments, paystack, router, sales, screens
+from bot.bot import bot, outbox
+from bot.dispatch import ChatDispatcher, instrument_handler
+from bot.outbox import Outbox
+from bot.router import CallbackRouter
+from bot.models import Broadcast, ConversationState, DeliveryDate, MismatchedPayment, Order, OrderItem, PendingStep, Product, ProductSales, Reciept
+from bot.state import DatabaseStateStore, DatabaseStepBackend, MemoryStateStore
+from bot.testing import PaystackStub, TelegramStub, callback_update, message_update
+
+
+# run handlers on the test thread instead of the dispatcher's pool
+inline_dispatch = mock.patch.object(bot.dispatcher, "executor", None)
+
+
+def as_message(payload):
+    return Update.de_json(json.dumps(payload)).message
+
+
+def as_callback(payload):
+    return Update.de_json(json.dumps(payload)).callback_query
+
+
+def create_orders(user_id, count, items_per_order=1, payed=False):
+    """
+    Creates count orders for a user, each holding items_per_order different products.
+    """
+    delivery_date = DeliveryDate.objects.order_by("-id").first() or DeliveryDate.objects.create(date=datetime.date(2025, 2, 1))
+    orders = []
+    for n in range(count):
+        order = Order.objects.create(
+            user_id=user_id,
+            username="tester",
+            full_name="Test User",
+            email="test@example.com",
+            hall="Paul",
+            room_no="A204",
+            payed=payed,
+            delivery_date=delivery_date,
+        )
+        for i in range(items_per_order):
+            product = Product.objects.create(title=f"Indomie {n}-{i}", price=9000, description="Chicken")
+            OrderItem.objects.create(order=order, product=product, quantity=i + 1)
+        if payed:
+            Reciept.objects.create(order=order, trxref=f"trx-{order.id}", reference=f"ref-{order.id}")
+        orders.append(order)
+    return orders
+
+
+
+@override_settings(TELEGRAM_WEBHOOK_SECRET="s3cret")
+class TelegramWebhookTests(TestCase):
+
+    def post_update(self, payload, secret="s3cret"):
+        return self.client.post(
+            reverse("telegram_webhook"),
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+        )
+
+    @inline_dispatch
+    @mock.patch.object(outbox, "send_message")
+    def test_update_is_fed_to_handlers(self, send_message):
+        response = self.post_update(message_update("/start"))
+
+        self.assertEqual(response.status_code, 200)
+        send_message.assert_called_once()
+        self.assertEqual(send_message.call_args.args[0], 1001)
+
+    @mock.patch.object(outbox, "send_message")
+    def test_wrong_secret_is_rejected(self, send_message):
+        response = self.post_update(message_update("/start"), secret="wrong")
+
+        self.assertEqual(response.status_code, 403)
+        send_message.assert_not_called()
+
+    @mock.patch.object(outbox, "send_message")
+    def test_updates_are_refused_without_a_secret(self, send_message):
+        with override_settings(TELEGRAM_WEBHOOK_SECRET=None):
+            self.assertEqual(self.post_update(message_update("/start"), secret="").status_code, 403)
+            with self.assertRaises(ImproperlyConfigured), mock.patch.object(bot, "set_webhook") as set_webhook:
+                handlers.set_webhook()
+        send_message.assert_not_called()
+        set_webhook.assert_not_called()
+
+    def test_malformed_update_is_rejected(self):
+        for body in ["{not json", "[]", "1", '"x"']:
+            response = self.client.post(
+                reverse("telegram_webhook"),
+                data=body,
+                content_type="application/json",
+                headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+            )
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.client.get(reverse("telegram_webhook")).status_code, 405)
+
+
+
+class ChatDispatcherTests(TestCase):
+
+    def test_chat_order_is_kept_while_other_chats_run(self):
+        handled = []
+        release = threading.Event()
+        other_chat_done = threading.Event()
+
+        def handle(update):
+            if update.name == "slow":
+                # block chat 1 until chat 2 has been handled
+                release.wait(5)
+            handled.append(update.name)
+            if update.name == "other":
+                other_chat_done.set()
+
+        dispatcher = ChatDispatcher(handle, num_threads=2)
+        dispatcher.submit(1, SimpleNamespace(update_id=1, name="slow"))
+        dispatcher.submit(1, SimpleNamespace(update_id=2, name="next"))
+        dispatcher.submit(2, SimpleNamespace(update_id=3, name="other"))
+
+        self.assertTrue(other_chat_done.wait(5))
+        release.set()
+        dispatcher.shutdown()
+
+        self.assertEqual(handled, ["other", "slow", "next"])
+
+
+
+class StateStoreTests(TestCase):
+
+    def test_memory_store_drops_least_recently_used(self):
+        store = MemoryStateStore(ttl=60, max_size=2)
+        store.set(1, {"product_id": 1})
+        store.set(2, {"product_id": 2})
+        store.get(1)
+        store.set(3, {"product_id": 3})
+
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.get(1), {"product_id": 1})
+        self.assertEqual(store.get(3), {"product_id": 3})
+
+    def test_memory_store_expires_entries(self):
+        store = MemoryStateStore(ttl=60)
+        with mock.patch("bot.state.time.monotonic", return_value=1000):
+            store.set(1, {"product_id": 1})
+        with mock.patch("bot.state.time.monotonic", return_value=1061):
+            self.assertIsNone(store.get(1))
+        self.assertEqual(len(store.entries), 0)
+
+    def test_database_store_round_trip_and_expiry(self):
+        store = DatabaseStateStore(ttl=60)
+        store.set(1, {"product_id": 1, "quantity": 2})
+        self.assertEqual(store.get(1), {"product_id": 1, "quantity": 2})
+
+        ConversationState.objects.filter(user_id=1).update(updated_at="2000-01-01T00:00:00Z")
+        self.assertIsNone(store.get(1))
+
+        store.set(2, {"product_id": 2})
+        store.delete(2)
+        self.assertFalse(ConversationState.objects.exists())
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "send_message")
+    def test_database_steps_outlive_the_process_that_asked(self, send_message, answer_callback_query):
+        product = Product.objects.create(title="Indomie Onion", price=8000)
+        order = create_orders(1001, 1)[0]
+        with mock.patch.object(handlers, "user_orders", DatabaseStateStore(ttl=60)), \
+                mock.patch.object(bot, "next_step_backend", DatabaseStepBackend(ttl=60)):
+            handlers.router.dispatch(as_callback(callback_update(f"1:order:{product.id}")))
+
+        # a restarted bot only has the database to go on
+        with mock.patch.object(handlers, "user_orders", DatabaseStateStore(ttl=60)), \
+                mock.patch.object(bot, "next_step_backend", DatabaseStepBackend(ttl=60)):
+            bot.process_new_messages([as_message(message_update("4"))])
+
+        self.assertEqual(order.orderitem_set.get(product=product).quantity, 4)
+        self.assertIn("Indomie Onion has been added", send_message.call_args.args[1])
+        self.assertFalse(PendingStep.objects.exists())
+
+    def test_expired_database_steps_are_dropped(self):
+        backend = DatabaseStepBackend(ttl=60)
+        backend.register_handler(1, Handler(handlers.get_quantity))
+        self.assertEqual([inspect.unwrap(h.callback) for h in backend.get_handlers(1)], [handlers.get_quantity])
+        self.assertIsNone(backend.get_handlers(1))
+
+        backend.register_handler(1, Handler(handlers.get_email))
+        PendingStep.objects.update(updated_at="2000-01-01T00:00:00Z")
+        self.assertIsNone(backend.get_handlers(1))
+
+
+
+@mock.patch.object(outbox, "send_message")
+class CartTests(TestCase):
+
+    def test_cart_lists_every_item_with_the_total(self, send_message):
+        order = create_orders(1001, 1, items_per_order=2)[0]
+
+        handlers.view_cart(as_message(message_update("/cart")))
+
+        msg = send_message.call_args.args[1]
+        self.assertIn("Indomie 0-1* x 2 - (₦18000)", msg)
+        self.assertIn("*💰 Total:* ₦27000", msg)
+        keyboard = json.loads(send_message.call_args.kwargs["reply_markup"])["inline_keyboard"]
+        buttons = [button["callback_data"] for row in keyboard for button in row]
+        self.assertEqual(buttons, ["1:checkout_cart", "1:remove_item_cart", f"1:remove_order:{order.id}"])
+
+    def test_cart_query_count_is_constant(self, send_message):
+        order = create_orders(1001, 1)[0]
+        with self.assertNumQueries(2):
+            handlers.view_cart(as_message(message_update("/cart")))
+
+        for n in range(5):
+            product = Product.objects.create(title=f"Indomie extra {n}", price=9000)
+            cart.add_to_cart(1001, product.id, 2)
+        self.assertEqual(order.orderitem_set.count(), 6)
+        with self.assertNumQueries(2):
+            handlers.view_cart(as_message(message_update("/cart")))
+
+    def test_empty_cart_is_one_query(self, send_message):
+        with self.assertNumQueries(1):
+            handlers.view_cart(as_message(message_update("/cart")))
+        self.assertIn("Your cart is empty", send_message.call_args.args[1])
+
+    def test_products_join_the_open_cart(self, send_message):
+        order = create_orders(1001, 1)[0]
+        product = order.orderitem_set.get().product
+        other = Product.objects.create(title="Indomie Onion", price=8000)
+
+        cart.add_to_cart(1001, product.id, 2)
+        cart.add_to_cart(1001, other.id, 1)
+
+        self.assertEqual(Order.objects.filter(user_id=1001, payed=False).count(), 1)
+        self.assertEqual(dict(order.orderitem_set.values_list("product_id", "quantity")), {product.id: 3, other.id: 1})
+
+    def test_quantity_with_an_open_cart_skips_delivery_details(self, send_message):
+        order = create_orders(1001, 1)[0]
+        product = Product.objects.create(title="Indomie Onion", price=8000)
+        handlers.user_orders.set(1001, {"product_id": product.id, "quantity": None, "hall": None, "room_no": None})
+
+        with mock.patch.object(bot, "register_next_step_handler") as register_next_step_handler:
+            handlers.get_quantity(as_message(message_update("4")))
+
+        register_next_step_handler.assert_not_called()
+        self.assertIn("Indomie Onion has been added", send_message.call_args.args[1])
+        self.assertEqual(order.orderitem_set.get(product=product).quantity, 4)
+        self.assertIsNone(handlers.user_orders.get(1001))
+
+    def test_failed_room_number_step_is_counted(self, send_message):
+        metrics.reset()
+        handlers.user_orders.set(1001, {
+            "product_id": 1, "quantity": 2, "email": "test@example.com", "fullname": "Test User", "hall": "John", "room_no": None,
+        })
+
+        with mock.patch.object(cart, "add_to_cart", side_effect=RuntimeError("database is down")), \
+                self.assertRaises(RuntimeError):
+            instrument_handler(handlers.get_room_no)(as_message(message_update("B204")))
+
+        self.assertIn("Something went wrong", send_message.call_args.args[1])
+        self.assertEqual(metrics.snapshot()["counters"]["handler.get_room_no.errors"], 1)
+
+    def test_first_product_starts_a_cart_with_the_delivery_details(self, send_message):
+        product = Product.objects.create(title="Indomie Onion", price=8000)
+        handlers.user_orders.set(1001, {
+            "product_id": product.id, "quantity": 2, "email": "test@example.com", "fullname": "Test User", "hall": "John", "room_no": None,
+        })
+
+        handlers.get_room_no(as_message(message_update("B204")))
+
+        order = Order.objects.get(user_id=1001, payed=False)
+        self.assertEqual((order.full_name, order.hall, order.room_no), ("Test User", "John", "B204"))
+        self.assertEqual(order.orderitem_set.get().quantity, 2)
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "edit_message_text")
+    def test_items_are_removed_from_the_users_own_cart_only(self, edit_message_text, answer_callback_query, send_message):
+        navigation.forget_all()
+        order = create_orders(1001, 1, items_per_order=2)[0]
+        first, second = order.orderitem_set.order_by("id")
+
+        handlers.router.dispatch(as_callback(callback_update(f"1:remove_item:{first.id}", user_id=1002)))
+        self.assertTrue(OrderItem.objects.filter(id=first.id).exists())
+
+        handlers.router.dispatch(as_callback(callback_update(f"1:remove_item:{first.id}")))
+        self.assertTrue(Order.objects.filter(id=order.id).exists())
+        # the picker is edited into what's left of the cart
+        self.assertNotIn("Indomie 0-0", edit_message_text.call_args.args[0])
+        self.assertIn("Indomie 0-1", edit_message_text.call_args.args[0])
+        handlers.router.dispatch(as_callback(callback_update(f"1:remove_item:{second.id}")))
+        # an empty cart is deleted along with its last item
+        self.assertFalse(Order.objects.filter(id=order.id).exists())
+        self.assertIn("Your cart is empty", edit_message_text.call_args.args[0])
+        send_message.assert_not_called()
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "edit_message_text")
+    def test_clearing_the_cart_only_deletes_the_users_own(self, edit_message_text, answer_callback_query, send_message):
+        order = create_orders(1001, 1, items_per_order=2)[0]
+
+        handlers.router.dispatch(as_callback(callback_update(f"1:remove_order:{order.id}", user_id=1002)))
+        self.assertTrue(Order.objects.filter(id=order.id).exists())
+        self.assertIn("Order not found", send_message.call_args.args[1])
+
+        handlers.router.dispatch(as_callback(callback_update(f"1:remove_order:{order.id}")))
+        self.assertFalse(Order.objects.filter(id=order.id).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=order.id).exists())
+        self.assertIn(f"Order #{order.id}* has been removed", edit_message_text.call_args.args[0])
+
+
+
+@mock.patch.object(outbox, "send_message")
+class PayedOrdersTests(TestCase):
+
+    def test_payed_orders_link_their_receipts(self, send_message):
+        order = create_orders(1001, 1, payed=True)[0]
+
+        handlers.view_payed_orders(as_message(message_update("/payed")))
+
+        msg = send_message.call_args.args[1]
+        self.assertIn(f"order_id={order.id}&trxref=trx-{order.id}&reference=ref-{order.id}", msg)
+        self.assertIsNone(send_message.call_args.kwargs["reply_markup"])
+
+    def test_payed_orders_query_count_is_constant(self, send_message):
+        create_orders(1001, 1, payed=True)
+        with self.assertNumQueries(2):
+            handlers.view_payed_orders(as_message(message_update("/payed")))
+
+        create_orders(1001, 4, items_per_order=3, payed=True)
+        with self.assertNumQueries(2):
+            handlers.view_payed_orders(as_message(message_update("/payed")))
+
+    def test_payed_orders_are_paginated(self, send_message):
+        orders = create_orders(1001, handlers.PAYED_ORDERS_PER_PAGE + 2, payed=True)
+
+        handlers.view_payed_orders(as_message(message_update("/payed")))
+        first_page = send_message.call_args
+        button = first_page.kwargs["reply_markup"].keyboard[0][0]
+        last_shown = orders[-handlers.PAYED_ORDERS_PER_PAGE]
+        self.assertEqual(button.callback_data, f"1:payed_before:{last_shown.id}")
+        self.assertIn(f"#{orders[-1].id}", first_page.args[1])
+        self.assertNotIn(f"#{orders[0].id}*", first_page.args[1])
+
+        with mock.patch.object(bot, "answer_callback_query"):
+            handlers.router.dispatch(as_callback(callback_update(button.callback_data)))
+        second_page = send_message.call_args
+        self.assertIn(f"#{orders[0].id}*", second_page.args[1])
+        self.assertNotIn(f"#{last_shown.id}*", second_page.args[1])
+        self.assertIsNone(second_page.kwargs["reply_markup"])
+
+    def test_pages_of_big_carts_fit_in_a_telegram_message(self, send_message):
+        orders = create_orders(1001, 5, items_per_order=24, payed=True)
+
+        handlers.view_payed_orders(as_message(message_update("/payed")))
+        msg = send_message.call_args.args[1]
+        self.assertLessEqual(handlers.message_length(msg), handlers.PAYED_PAGE_MAX_LENGTH)
+        # the delivery date and status are shown once per order, not per item
+        self.assertEqual(msg.count("Delivery date"), msg.count("Order id"))
+        self.assertLess(msg.count("Order id"), len(orders))
+        self.assertIsNotNone(send_message.call_args.kwargs["reply_markup"])
+
+        order = create_orders(1001, 1, items_per_order=150, payed=True)[0]
+        handlers.view_payed_orders(as_message(message_update("/payed")))
+        msg = send_message.call_args.args[1]
+        self.assertLessEqual(handlers.message_length(msg), handlers.PAYED_PAGE_MAX_LENGTH)
+        self.assertIn(f"#{order.id}*", msg)
+        self.assertIn("more items", msg)
+
+    def test_old_page_buttons_start_from_the_newest_order(self, send_message):
+        order = create_orders(1001, 1, payed=True)[0]
+
+        with mock.patch.object(bot, "answer_callback_query"):
+            handlers.router.dispatch(as_callback(callback_update("payed_page_1")))
+        self.assertIn(f"#{order.id}*", send_message.call_args.args[1])
+
+    def test_negative_page_is_only_acknowledged(self, send_message):
+        create_orders(1001, 1, payed=True)
+
+        with mock.patch.object(bot, "answer_callback_query") as answer_callback_query, self.assertLogs("bot.router", "WARNING"):
+            handlers.route_callback(as_callback(callback_update("1:payed_page:-1")))
+
+        answer_callback_query.assert_called_once()
+        send_message.assert_not_called()
+
+
+
+@mock.patch.object(bot, "answer_callback_query")
+@mock.patch.object(outbox, "edit_message_text")
+@mock.patch.object(outbox, "send_message")
+class CatalogueTests(TestCase):
+
+    def setUp(self):
+        catalogue.invalidate()
+        navigation.forget_all()
+        self.product = Product.objects.create(title="Indomie Chicken", price=9000, description="40 packs")
+
+    def test_browsing_needs_no_queries_once_cached(self, send_message, edit_message_text, answer_callback_query):
+        handlers.products(as_message(message_update("/products")))
+
+        with self.assertNumQueries(0):
+            handlers.products(as_message(message_update("/products")))
+            handlers.router.dispatch(as_callback(callback_update(f"1:product:{self.product.id}")))
+
+        # the product list is edited into the product
+        self.assertEqual(send_message.call_count, 2)
+        self.assertIn("Indomie Chicken* - 💰 ₦9000", edit_message_text.call_args.args[0])
+        self.assertIn(f"1:order:{self.product.id}", edit_message_text.call_args.kwargs["reply_markup"])
+        self.assertIn("1:products", edit_message_text.call_args.kwargs["reply_markup"])
+
+    def test_admin_edits_invalidate_the_cache(self, send_message, edit_message_text, answer_callback_query):
+        handlers.products(as_message(message_update("/products")))
+
+        self.product.price = 9500
+        self.product.save()
+        Product.objects.create(title="Indomie Onion", price=8000)
+
+        handlers.router.dispatch(as_callback(callback_update(f"1:product:{self.product.id}")))
+        self.assertIn("₦9500", edit_message_text.call_args.args[0])
+        handlers.products(as_message(message_update("/products")))
+        self.assertIn("Indomie Onion", send_message.call_args.kwargs["reply_markup"])
+
+        product_id = self.product.id
+        self.product.delete()
+        handlers.router.dispatch(as_callback(callback_update(f"1:product:{product_id}")))
+        self.assertIn("vanished", edit_message_text.call_args.args[0])
+
+    @override_settings(CATALOGUE_CACHE="default", CATALOGUE_CACHE_TTL=60)
+    def test_shared_cache_copy_expires(self, send_message, edit_message_text, answer_callback_query):
+        cache.clear()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            catalogue.get_catalogue()
+        self.assertEqual(cache_set.call_args.kwargs["timeout"], 60)
+
+
+
+class PaystackClientTests(TestCase):
+
+    def setUp(self):
+        self.stub = PaystackStub().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(PAYSTACK_BASE_URL=self.stub.url, PAYSTACK_READ_TIMEOUT=0.5)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # a fresh pool per test, the stub listens on a new port every time
+        self.addCleanup(setattr, paystack, "_session", None)
+        metrics.reset()
+
+    def test_initialize_and_verify_share_a_connection(self):
+        data = paystack.initialize_transaction(9000, "test@example.com", "http://testserver/callback/")
+        self.assertEqual(data["data"]["authorization_url"], "https://checkout.paystack.com/ref_1")
+        self.assertEqual(self.stub.requests[0]["body"]["amount"], "900000")
+
+        self.assertEqual(paystack.verify_transaction("ref_1")["data"]["status"], "success")
+        self.assertEqual(self.stub.connections, 1)
+
+        latencies = metrics.snapshot()["latencies"]
+        self.assertEqual(latencies["paystack.transaction.initialize"]["count"], 1)
+        self.assertEqual(latencies["paystack.transaction.verify"]["count"], 1)
+
+    @override_settings(PAYSTACK_MAX_RETRIES=2)
+    def test_verify_is_retried_on_server_errors(self):
+        self.stub.fail_next = 2
+        with mock.patch("urllib3.util.retry.Retry.sleep"):
+            self.assertTrue(paystack.verify_transaction("ref_1")["status"])
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_initialize_is_not_retried_on_server_errors(self):
+        self.stub.fail_next = 1
+        self.assertFalse(paystack.initialize_transaction(9000, "test@example.com", "http://testserver/")["status"])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_slow_paystack_times_out(self):
+        self.stub.delay = 1
+        with mock.patch("urllib3.util.retry.Retry.sleep"), self.assertRaises(paystack.PaystackError):
+            paystack.initialize_transaction(9000, "test@example.com", "http://testserver/")
+        self.assertEqual(metrics.snapshot()["counters"]["paystack.transaction.initialize.errors"], 1)
+
+
+
+class PaymentLinkTests(TestCase):
+
+    def setUp(self):
+        self.stub = PaystackStub().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(PAYSTACK_BASE_URL=self.stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(setattr, paystack, "_session", None)
+        self.order = create_orders(1001, 1)[0]
+
+    def test_repeat_checkouts_reuse_the_link(self):
+        first = payments.get_payment_url(self.order.id, 9000)
+        second = payments.get_payment_url(self.order.id, 9000)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.stub.requests), 1)
+        body = self.stub.requests[0]["body"]
+        self.assertEqual(body["email"], "test@example.com")
+        self.assertEqual(json.loads(body["metadata"]), {"order_id": self.order.id})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_reference, body["reference"])
+
+    def test_new_link_when_amount_changes_or_link_expires(self):
+        first = payments.get_payment_url(self.order.id, 9000)
+        second = payments.get_payment_url(self.order.id, 18000)
+        self.assertNotEqual(first, second)
+
+        Order.objects.filter(id=self.order.id).update(payment_expires_at="2000-01-01T00:00:00Z")
+        self.assertNotEqual(payments.get_payment_url(self.order.id, 18000), second)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_link_stored_during_the_paystack_call_wins(self):
+        initialize_transaction = paystack.initialize_transaction
+
+        def concurrent_checkout(*args, **kwargs):
+            # the order isn't locked while paystack answers, another checkout stores its link meanwhile
+            Order.objects.filter(id=self.order.id).update(
+                payment_url="https://checkout.paystack.com/other", payment_reference="other",
+                payment_amount=9000, payment_expires_at=timezone.now() + datetime.timedelta(minutes=30),
+            )
+            return initialize_transaction(*args, **kwargs)
+
+        with mock.patch.object(paystack, "initialize_transaction", side_effect=concurrent_checkout):
+            self.assertEqual(payments.get_payment_url(self.order.id, 9000), "https://checkout.paystack.com/other")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_reference, "other")
+
+    def test_payed_orders_get_no_link(self):
+        Order.objects.filter(id=self.order.id).update(payed=True)
+        with self.assertRaises(Order.DoesNotExist):
+            payments.get_payment_url(self.order.id, 9000)
+        self.assertEqual(self.stub.requests, [])
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "edit_message_text")
+    def test_double_tapped_checkout_calls_paystack_once(self, edit_message_text, answer_callback_query):
+        navigation.forget_all()
+        call = as_callback(callback_update(f"process_checkout_{self.order.id}"))
+        handlers.router.dispatch(call)
+        handlers.router.dispatch(call)
+
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertIn("https://checkout.paystack.com/order-", edit_message_text.call_args.args[0])
+        # the second tap would show the same link, so the message isn't edited again
+        edit_message_text.assert_called_once()
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "edit_message_text")
+    @mock.patch.object(outbox, "send_message")
+    def test_other_users_order_cant_be_checked_out(self, send_message, edit_message_text, answer_callback_query):
+        handlers.router.dispatch(as_callback(callback_update(f"process_checkout_{self.order.id}", user_id=1002)))
+
+        self.assertEqual(self.stub.requests, [])
+        edit_message_text.assert_not_called()
+        self.assertIn("Order not found", send_message.call_args.args[1])
+
+    @mock.patch.object(bot, "answer_callback_query")
+    @mock.patch.object(outbox, "edit_message_text")
+    def test_whole_cart_is_checked_out_in_one_payment(self, edit_message_text, answer_callback_query):
+        product = Product.objects.create(title="Indomie Onion", price=8000)
+        cart.add_to_cart(1001, product.id, 2)
+
+        handlers.router.dispatch(as_callback(callback_update("1:checkout_cart")))
+
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.stub.requests[0]["body"]["amount"], "2500000")
+        self.assertIn("💰 *Total: ₦25000*", edit_message_text.call_args.args[0])
+
+
+
+class PaystackCallbackTests(TestCase):
+
+    def setUp(self):
+        self.stub = PaystackStub().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(PAYSTACK_BASE_URL=self.stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(setattr, paystack, "_session", None)
+        self.order = create_orders(1001, 1)[0]
+        payments.get_payment_url(self.order.id, 9000)
+        self.order.refresh_from_db()
+        self.stub.requests.clear()
+
+    def callback(self, reference=None):
+        reference = reference or self.order.payment_reference
+        return self.client.get(
+            reverse("paystack_callback"),
+            {"order_id": self.order.id, "trxref": reference, "reference": reference},
+        )
+
+    def test_successful_payment_marks_order_payed_once(self):
+        self.assertContains(self.callback(), "Payment Successful")
+        self.assertContains(self.callback(), "Payment Successful")
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.payed)
+        self.assertEqual(Reciept.objects.get(order=self.order).trxref, self.order.payment_reference)
+        self.assertEqual([r["path"] for r in self.stub.requests], [f"/transaction/verify/{self.order.payment_reference}"] * 2)
+
+    def test_old_link_doesnt_pay_a_grown_cart(self):
+        product = Product.objects.create(title="Indomie Onion", price=50000)
+        cart.add_to_cart(1001, product.id, 10)
+
+        response = self.callback()
+        self.assertContains(response, "Payment Failed", status_code=400)
+        self.assertFalse(Order.objects.get(id=self.order.id).payed)
+        # the money was taken, so the charge is kept for an admin to refund or honour
+        payment = MismatchedPayment.objects.get()
+        self.assertEqual((payment.order_id, payment.reference, payment.amount), (self.order.id, self.order.payment_reference, 900000))
+        self.assertContains(response, self.order.payment_reference, status_code=400)
+
+    def test_another_orders_payment_is_rejected(self):
+        other = create_orders(1002, 1)[0]
+        payments.get_payment_url(other.id, 9000)
+        other.refresh_from_db()
+
+        self.assertContains(self.callback(other.payment_reference), "Payment Failed", status_code=400)
+        self.assertFalse(Order.objects.get(id=self.order.id).payed)
+
+    def test_success_page_is_rendered_from_one_order_lookup(self):
+        # the order and its items are read once (2), the rest is marking it payed: the save (2), its sales refresh (4),
+        # the receipt (2) and the savepoints around them (6)
+        with self.assertNumQueries(12):
+            response = self.callback()
+        self.assertContains(response, "Indomie 0-0 x 1")
+        self.assertContains(response, "Paul, Room A204")
+        self.assertContains(response, 'id="receipt-data"')
+        self.assertNotContains(response, "Loading...")
+
+    def test_failed_payment_leaves_order_unpayed(self):
+        self.stub.verify_status = "failed"
+        self.assertContains(self.callback(), "Payment Failed")
+
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.payed)
+        self.assertFalse(Reciept.objects.exists())
+
+    def test_unreachable_paystack_renders_failure(self):
+        self.stub.stop()
+        with override_settings(PAYSTACK_MAX_RETRIES=0):
+            self.assertContains(self.callback(), "Payment Failed")
+
+
+
+@mock.patch.object(notifications, "notify_order_paid")
+class PaystackWebhookTests(TestCase):
+
+    def setUp(self):
+        self.order = create_orders(1001, 1)[0]
+        Order.objects.filter(id=self.order.id).update(payment_reference="order-ref", payment_amount=9000)
+
+    def post_event(self, event, signature=None):
+        body = json.dumps(event).encode()
+        if signature is None:
+            signature = hmac.new(b"sk_test", body, hashlib.sha512).hexdigest()
+        return self.client.post(
+            reverse("paystack_webhook"),
+            data=body,
+            content_type="application/json",
+            headers={"X-Paystack-Signature": signature},
+        )
+
+    def charge(self, **data):
+        return {"event": "charge.success", "data": {"status": "success", "reference": "order-ref", "amount": 900000, **data}}
+
+    @override_settings(PAYSTACK_SECRET_KEY="sk_test")
+    def test_charge_marks_order_payed_and_notifies_once(self, notify_order_paid):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post_event(self.charge()).status_code, 200)
+            self.assertEqual(self.post_event(self.charge()).status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.payed)
+        self.assertEqual(Reciept.objects.get(order=self.order).reference, "order-ref")
+        notify_order_paid.assert_called_once()
+        self.assertEqual(notify_order_paid.call_args.args[0].user_id, 1001)
+
+    @override_settings(PAYSTACK_SECRET_KEY="sk_test")
+    def test_order_is_found_by_metadata(self, notify_order_paid):
+        charge = self.charge(reference="other-ref", metadata=json.dumps({"order_id": self.order.id}))
+        self.assertEqual(self.post_event(charge).status_code, 200)
+        self.assertTrue(Order.objects.get(id=self.order.id).payed)
+
+    @override_settings(PAYSTACK_SECRET_KEY="sk_test")
+    def test_bad_signature_and_wrong_amount_are_rejected(self, notify_order_paid):
+        self.assertEqual(self.post_event(self.charge(), signature="forged").status_code, 403)
+        self.assertEqual(self.post_event(self.charge(amount=100)).status_code, 400)
+
+        # the amount is checked against the order's total even without a stored link amount
+        Order.objects.filter(id=self.order.id).update(payment_amount=None)
+        self.assertEqual(self.post_event(self.charge(amount=100)).status_code, 400)
+        # a charge found by its metadata still has to pay the order's current total
+        charge = self.charge(reference="other-ref", metadata=json.dumps({"order_id": self.order.id}), amount=100)
+        self.assertEqual(self.post_event(charge).status_code, 400)
+
+        self.assertFalse(Order.objects.get(id=self.order.id).payed)
+        notify_order_paid.assert_not_called()
+        # paystack retries rejected events, each charge is recorded once
+        self.assertEqual(sorted(MismatchedPayment.objects.values_list("reference", flat=True)), ["order-ref", "other-ref"])
+
+
+
+class FakeTelegram:
+    """
+    Records send_message calls, answering the first throttle_first calls with a 429.
+    """
+
+    def __init__(self, throttle_first=0):
+        self.throttle_first = throttle_first
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.throttle_first:
+            self.throttle_first -= 1
+            raise ApiTelegramException(
+                "sendMessage", None,
+                {"error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 0.05}},
+            )
+        self.sent.append((chat_id, text))
+        return text
+
+
+
+class OutboxTests(TestCase):
+
+    def test_throttled_messages_are_retried_in_order(self):
+        telegram = FakeTelegram(throttle_first=1)
+        outbox = Outbox(telegram, global_rate=100, chat_rate=100, chat_burst=10)
+
+        futures = [outbox.send_message(1, f"message {n}") for n in range(3)]
+        outbox.send_message(2, "other chat")
+
+        self.assertTrue(outbox.join(timeout=5))
+        self.assertEqual([text for chat_id, text in telegram.sent if chat_id == 1], ["message 0", "message 1", "message 2"])
+        self.assertEqual(futures[0].result(), "message 0")
+
+    def test_per_chat_rate_is_respected(self):
+        telegram = FakeTelegram()
+        outbox = Outbox(telegram, global_rate=100, chat_rate=20, chat_burst=1)
+
+        start = time.monotonic()
+        for n in range(5):
+            outbox.send_message(1, f"message {n}")
+        self.assertTrue(outbox.join(timeout=5))
+
+        # one message straight away, then one every 50ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertEqual(len(telegram.sent), 5)
+
+    def test_failed_calls_resolve_their_future(self):
+        outbox = Outbox(FakeTelegram(throttle_first=10), global_rate=100, chat_rate=100, chat_burst=10, max_attempts=2)
+
+        future = outbox.send_message(1, "hello")
+        with self.assertRaises(ApiTelegramException):
+            future.result(timeout=5)
+
+
+
+def sent_future(result=None, exception=None):
+    future = Future()
+    if exception:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+
+class BroadcastTests(TestCase):
+
+    def setUp(self):
+        for user_id in [3, 1, 2, 4]:
+            create_orders(user_id, 2, payed=True)
+        create_orders(5, 1)  # unpayed
+        delivered = create_orders(6, 1, payed=True)[0]
+        Order.objects.filter(id=delivered.id).update(delivered=True)
+
+    @mock.patch.object(outbox, "send_message", return_value=sent_future())
+    def test_each_buyer_is_messaged_once(self, send_message):
+        sent = broadcast.run_broadcast(Broadcast.objects.create(message="Delivery on Monday"), chunk_size=3)
+
+        self.assertEqual([c.args[0] for c in send_message.call_args_list], [1, 2, 3, 4])
+        sent.refresh_from_db()
+        self.assertEqual((sent.sent_count, sent.failed_count, sent.last_user_id), (4, 0, 4))
+        self.assertIsNotNone(sent.completed_at)
+
+    @mock.patch.object(outbox, "send_message")
+    def test_broadcast_resumes_after_checkpoint(self, send_message):
+        send_message.side_effect = lambda chat_id, *args, **kwargs: sent_future(
+            exception=Exception("bot was blocked by the user") if chat_id == 2 else None
+        )
+        interrupted = Broadcast.objects.create(message="Delivery on Monday", last_user_id=1, sent_count=1)
+
+        broadcast.run_broadcast(interrupted, chunk_size=2)
+
+        self.assertEqual([c.args[0] for c in send_message.call_args_list], [2, 3, 4])
+        interrupted.refresh_from_db()
+        self.assertEqual((interrupted.sent_count, interrupted.failed_count), (3, 1))
+
+
+
+@mock.patch.object(outbox, "send_message")
+class MarkDeliveredActionTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.admin)
+
+    def test_selected_orders_are_delivered_and_buyers_notified(self, send_message):
+        first, second = create_orders(1001, 2, payed=True)
+        other = create_orders(1002, 1, payed=True)[0]
+        unpayed = create_orders(1003, 1)[0]
+        selected = [first, second, other, unpayed]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("admin:bot_order_changelist"), {
+                "action": "mark_delivered",
+                "_selected_action": [order.id for order in selected],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in queries), 1)
+
+        self.assertEqual(set(Order.objects.filter(delivered=True)), {first, second, other})
+        self.assertEqual(sorted(c.args[0] for c in send_message.call_args_list), [1001, 1002])
+        self.assertIn(f"#{first.id} (Paul Hall), #{second.id}", send_message.call_args_list[0].args[1])
+
+
+
+class ProductSalesTests(TestCase):
+
+    def sales_of(self, product):
+        return list(ProductSales.objects.filter(product=product).values_list("paid_cartons", "revenue", "pending_cartons"))
+
+    def test_sales_follow_items_and_payments(self):
+        order = create_orders(1001, 1, items_per_order=2)[0]
+        product = order.orderitem_set.get(quantity=2).product
+        self.assertEqual(self.sales_of(product), [(0, 0, 2)])
+
+        order.refresh_from_db()
+        payments.mark_order_paid(order.id, "trx", {"reference": "ref", "amount": order.total * 100, "metadata": {"order_id": order.id}})
+        self.assertEqual(self.sales_of(product), [(2, 18000, 0)])
+
+        other = create_orders(1002, 1)[0]
+        item = OrderItem.objects.create(order=other, product=product, quantity=3)
+        self.assertEqual(self.sales_of(product), [(2, 18000, 3)])
+
+        item.delete()
+        self.assertEqual(self.sales_of(product), [(2, 18000, 0)])
+
+    def test_cart_changes_dont_sum_the_product_history(self):
+        product = Product.objects.create(title="Indomie Onion", price=9000, description="Chicken")
+        for order in create_orders(1001, 20, payed=True):
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        cart = create_orders(1002, 1)[0]
+        item = OrderItem.objects.create(order=cart, product=product, quantity=2)
+
+        with CaptureQueriesContext(connection) as queries:
+            item.quantity = 5
+            item.save()
+        # only the cart's own row is touched, no query reads the product's other items
+        self.assertFalse(any("bot_orderitem\".\"product_id\" IN" in query["sql"] for query in queries))
+        self.assertEqual(self.sales_of(product), [(20, 180000, 5)])
+
+        cart.delete()
+        self.assertEqual(self.sales_of(product), [(20, 180000, 0)])
+
+    def test_rebuild_matches_incremental_updates(self):
+        create_orders(1001, 2, items_per_order=2, payed=True)
+        create_orders(1002, 1, items_per_order=3)
+        expected = set(ProductSales.objects.values_list("product_id", "delivery_date_id", "paid_cartons", "revenue", "pending_cartons"))
+
+        ProductSales.objects.all().delete()
+        sales.rebuild_product_sales()
+        rebuilt = set(ProductSales.objects.values_list("product_id", "delivery_date_id", "paid_cartons", "revenue", "pending_cartons"))
+        self.assertEqual(rebuilt, expected)
+
+    def test_admin_reads_the_sales_table(self):
+        create_orders(1001, 1, items_per_order=2, payed=True)
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:bot_product_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any("bot_orderitem" in query["sql"] for query in queries))
+        self.assertContains(response, "18000")
+
+
+
+class ManifestTests(TestCase):
+
+    def setUp(self):
+        self.paul_b, self.paul_a = create_orders(1001, 2, items_per_order=2, payed=True)
+        Order.objects.filter(id=self.paul_b.id).update(room_no="B101")
+        self.john = create_orders(1002, 1, payed=True)[0]
+        Order.objects.filter(id=self.john.id).update(hall="John")
+        delivered = create_orders(1003, 1, payed=True)[0]
+        Order.objects.filter(id=delivered.id).update(delivered=True)
+        self.unpayed = create_orders(1004, 1)[0]
+
+    def test_orders_are_listed_by_hall_then_room(self):
+        with CaptureQueriesContext(connection) as queries:
+            text = "".join(manifest.manifest_lines(chunk_size=2))
+        # delivery date, orders, then the items of each of the two chunks
+        self.assertEqual(len(queries), 4)
+
+        order_lines = [line for line in text.splitlines() if line.startswith(("==", "Room"))]
+        self.assertEqual(order_lines[0], "== John Hall ==")
+        self.assertIn(f"Order #{self.john.id}", order_lines[1])
+        self.assertEqual(order_lines[2], "== Paul Hall ==")
+        self.assertTrue(order_lines[3].startswith("Room A204"))
+        self.assertTrue(order_lines[4].startswith("Room B101"))
+        self.assertEqual(len(order_lines), 5)
+        self.assertIn("1 x Indomie 0-0, 2 x Indomie 0-1", order_lines[4])
+        self.assertIn("-- Paul Hall: 2 orders, 6 cartons --", text)
+
+    def test_admin_streams_the_manifest(self):
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse("admin:bot_order_manifest"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        text = b"".join(response.streaming_content).decode()
+        self.assertIn(f"Order #{self.paul_a.id}", text)
+        self.assertNotIn(f"Order #{self.unpayed.id}", text)
+
+
+
+class OrderDetailsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.order = create_orders(1001, 1, items_per_order=2, payed=True)[0]
+        self.url = reverse("order-details", args=[self.order.id])
+
+    def test_unchanged_orders_are_revalidated_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][1], {"product": {"title": "Indomie 0-1"}, "quantity": 2})
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_item_and_product_changes_invalidate_the_cache(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        item = self.order.orderitem_set.get(quantity=2)
+        item.quantity = 5
+        item.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][1]["quantity"], 5)
+
+        item.product.title = "Indomie Onion"
+        item.product.save()
+        self.assertEqual(self.client.get(self.url).json()["items"][1]["product"]["title"], "Indomie Onion")
+
+    def test_missing_orders_are_not_found(self):
+        response = self.client.get(reverse("order-details", args=[self.order.id + 100]))
+        self.assertEqual(response.status_code, 404)
+
+
+
+class OrderTotalsTests(TestCase):
+
+    def test_totals_follow_the_items(self):
+        order = create_orders(1001, 1, items_per_order=2)[0]
+        order.refresh_from_db()
+        self.assertEqual((order.subtotal, order.total), (27000, 27000))
+
+        item = order.orderitem_set.get(quantity=1)
+        item.quantity = 3
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total, 45000)
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total, 18000)
+
+    def test_price_changes_reach_carts_but_not_payed_orders(self):
+        payed = create_orders(1001, 1, payed=True)[0]
+        product = payed.orderitem_set.get().product
+        order = create_orders(1002, 1)[0]
+        cart.add_to_cart(1002, product.id, 2)
+
+        product.price = 10000
+        product.save()
+
+        payed.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(payed.orderitem_set.get().unit_price, 9000)
+        self.assertEqual(payed.total, 9000)
+        self.assertEqual(order.orderitem_set.get(product=product).unit_price, 10000)
+        self.assertEqual(order.total, 9000 + 20000)
+        self.assertEqual(ProductSales.objects.get(product=product).revenue, 9000)
+
+
+
+class CallbackRouterTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.router = CallbackRouter()
+        self.calls = []
+        self.router.route("order", int)(lambda call, product_id: self.calls.append(("order", product_id)))
+        self.router.route("help_page", str)(lambda call, page: self.calls.append(("help_page", page)))
+        self.router.route("checkout_cart")(lambda call: self.calls.append(("checkout_cart",)))
+
+    def dispatch(self, data):
+        return self.router.dispatch(as_callback(callback_update(data)))
+
+    def test_current_and_legacy_payloads_reach_their_route(self):
+        self.assertTrue(self.dispatch(router.encode("order", 5)))
+        self.assertTrue(self.dispatch("order_6"))
+        self.assertTrue(self.dispatch("help_how_to_order"))
+        self.assertTrue(self.dispatch("checkout_single_order"))
+
+        self.assertEqual(self.calls, [("order", 5), ("order", 6), ("help_page", "how_to_order"), ("checkout_cart",)])
+        self.assertEqual(metrics.snapshot()["latencies"]["callback.order"]["count"], 2)
+
+    def test_malformed_data_is_rejected_before_any_handler(self):
+        malformed = [
+            "order_x", "1:order", "1:order:5:6", "2:order:5", "1:unknown", "nonsense", "1:order:" + "9" * 70,
+            "1:order:-1", "order_-1", "1:order: 5", "1:order:1_000",
+        ]
+        with self.assertLogs("bot.router", "WARNING"):
+            for data in malformed:
+                self.assertFalse(self.dispatch(data), data)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(metrics.snapshot()["counters"]["callback.rejected"], len(malformed))
+
+    def test_oversized_payloads_cant_be_encoded(self):
+        with self.assertRaises(ValueError):
+            router.encode("hall", "x" * 64)
+        with self.assertRaises(ValueError):
+            router.encode("hall", "a:b")
+
+
+
+@mock.patch.object(bot, "answer_callback_query")
+@mock.patch.object(outbox, "send_message")
+class ScreensTests(TestCase):
+
+    def tearDown(self):
+        screens.reload()
+
+    def test_every_hall_button_sends_its_own_hall(self, send_message, answer_callback_query):
+        keyboard = json.loads(screens.get_screen("halls")["markup"])["inline_keyboard"]
+        buttons = {button["text"]: button["callback_data"] for row in keyboard for button in row}
+
+        self.assertEqual(len(buttons), len(django_settings.BOT_HALLS))
+        self.assertEqual(buttons["Peter Hall"], "1:hall:Peter")
+        self.assertEqual(buttons["Mary Hall"], "1:hall:Mary")
+
+    @override_settings(BOT_HALLS=["Paul", "Abigail"])
+    def test_halls_come_from_settings(self, send_message, answer_callback_query):
+        screens.reload()
+        handlers.user_orders.set(1001, {"product_id": 1, "quantity": 1, "email": "test@example.com", "fullname": "Test User"})
+
+        with mock.patch.object(bot, "register_next_step_handler"):
+            handlers.router.dispatch(as_callback(callback_update("1:hall:Abigail")))
+        self.assertIn("Abigail Hall", send_message.call_args.args[1])
+
+        handlers.router.dispatch(as_callback(callback_update("1:hall:Peter")))
+        self.assertIn("We don't deliver to that hall", send_message.call_args.args[1])
+        self.assertEqual(handlers.user_orders.get(1001)["hall"], "Abigail")
+
+    def test_screens_are_sent_prebuilt(self, send_message, answer_callback_query):
+        handlers.start(as_message(message_update("/start")))
+        handlers.start(as_message(message_update("/start")))
+
+        first, second = send_message.call_args_list
+        self.assertIs(first.kwargs["reply_markup"], second.kwargs["reply_markup"])
+        self.assertIs(first.kwargs["reply_markup"], screens.get_screen("start")["markup"])
+
+
+
+class NavigationTests(TestCase):
+
+    def setUp(self):
+        navigation.forget_all()
+        self.message = as_callback(callback_update("1:help")).message
+
+    @mock.patch.object(outbox, "edit_message_reply_markup")
+    @mock.patch.object(outbox, "edit_message_text", return_value=sent_future())
+    def test_unchanged_screens_are_not_edited(self, edit_message_text, edit_message_reply_markup):
+        screen = screens.get_screen("help_intro")
+        navigation.show_screen(self.message, screen["msg"], screen["markup"], edit=True)
+        navigation.show_screen(self.message, screen["msg"], screen["markup"], edit=True)
+        edit_message_text.assert_called_once()
+
+        # a new keyboard under the same text only edits the keyboard
+        navigation.show_screen(self.message, screen["msg"], screens.get_screen("help")["markup"], edit=True)
+        edit_message_text.assert_called_once()
+        edit_message_reply_markup.assert_called_once_with(1001, 1, reply_markup=screens.get_screen("help")["markup"])
+
+    @mock.patch.object(outbox, "send_message", return_value=sent_future())
+    @mock.patch.object(outbox, "edit_message_text")
+    def test_failed_edits_send_a_new_message(self, edit_message_text, send_message):
+        failed = Future()
+        failed.set_exception(ApiTelegramException("editMessageText", None, {
+            "error_code": 400, "description": "Bad Request: message can't be edited",
+        }))
+        edit_message_text.return_value = failed
+
+        result = navigation.show_screen(self.message, "*Hi*", edit=True)
+
+        send_message.assert_called_once_with(1001, "*Hi*", parse_mode="Markdown", reply_markup=None)
+        self.assertEqual(result.result(timeout=1), send_message.return_value.result())
+
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    @inline_dispatch
+    @override_settings(TELEGRAM_WEBHOOK_SECRET="s3cret")
+    @mock.patch.object(outbox, "send_message")
+    def test_updates_are_timed_with_their_queries(self, send_message):
+        self.client.post(
+            reverse("telegram_webhook"),
+            data=json.dumps(message_update("/cart")),
+            content_type="application/json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+        )
+
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn("indomie_update_duration_seconds_count 1\n", body)
+        self.assertIn('indomie_handler_duration_seconds_count{handler="view_cart"} 1\n', body)
+        # an empty cart is one query
+        self.assertIn('indomie_update_queries_bucket{le="1"} 1\n', body)
+        self.assertIn('indomie_update_queries_bucket{le="0"} 0\n', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.observe("telegram.send_message", 0.02)
+        metrics.observe("telegram.send_message", 3)
+        metrics.increment("telegram.send_message.errors")
+
+        metrics.observe("telegram.answer_callback_query", 0.01)
+
+        body = metrics.render_prometheus()
+        metric = "indomie_telegram_request_duration_seconds"
+        self.assertEqual(body.count(f"# TYPE {metric} histogram"), 1)
+        self.assertIn(f'{metric}_bucket{{method="send_message",le="0.01"}} 0\n', body)
+        self.assertIn(f'{metric}_bucket{{method="send_message",le="0.025"}} 1\n', body)
+        self.assertIn(f'{metric}_bucket{{method="send_message",le="5"}} 2\n', body)
+        self.assertIn(f'{metric}_bucket{{method="send_message",le="+Inf"}} 2\n', body)
+        self.assertIn(f'{metric}_count{{method="answer_callback_query"}} 1\n', body)
+        self.assertIn('indomie_errors_total{name="telegram.send_message"} 1\n', body)
+        self.assertIn("telegram.send_message: n=2", metrics.summary())
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_need_the_token_when_set(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), headers={"Authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+
+
+
+class LoadTestTests(TestCase):
+
+    def setUp(self):
+        self.stub = PaystackStub().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(PAYSTACK_BASE_URL=self.stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(setattr, paystack, "_session", None)
+        self.addCleanup(metrics.keep_samples, False)
+        DeliveryDate.objects.create(date=datetime.date(2025, 2, 1))
+
+    @inline_dispatch
+    @mock.patch.object(outbox, "call", return_value=sent_future())
+    def test_every_synthetic_user_checks_out(self, call):
+        product = Product.objects.create(title="Indomie Chicken", price=9000)
+        updates = loadtest.rush(3, [product.id], ["Paul", "John"])
+
+        with TelegramStub() as telegram:
+            elapsed = loadtest.replay(bot, updates)
+        results = loadtest.report(len(updates), elapsed)
+
+        orders = Order.objects.filter(user_id__gte=loadtest.FIRST_USER_ID).order_by("user_id")
+        self.assertEqual([order.hall for order in orders], ["Paul", "John", "Paul"])
+        self.assertTrue(all(order.payment_url and order.total == 18000 for order in orders))
+        self.assertEqual(len(self.stub.requests), 3)
+        # every tap was answered
+        self.assertEqual([method for method, params in telegram.calls], ["answerCallbackQuery"] * 12)
+
+        self.assertEqual(results["errors"], {})
+        timed = {row[0]: row[1] for row in results["rows"]}
+        self.assertEqual(timed["bot.update"], 27)
+        self.assertEqual(timed["handler.get_room_no"], 3)
+        self.assertEqual(timed["callback.checkout_cart"], 3)
+        # answered straight from the handlers, not through the outbox
+        self.assertEqual(timed["telegram.answer_callback_query"], 12)
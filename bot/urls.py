@@ -1,11 +1,15 @@
 from django.urls import path
 from django.conf import settings
 from django.views.generic.base import RedirectView
-from .views import paystack_callback, get_order_details, home
+from .views import paystack_callback, paystack_webhook, get_order_details, home, prometheus_metrics, telegram_webhook
 
 urlpatterns = [
     path('', home, name="home"),
     path('telegram_bot/', RedirectView.as_view(url=f"{settings.TELEGRAM_URL}", permanent=True), name="telegram_url"),
     path('paystack/callback/', paystack_callback, name='paystack_callback'),
+    path('paystack/webhook/', paystack_webhook, name='paystack_webhook'),
     path("api/orders/<int:order_id>/", get_order_details, name="order-details"),
+    path('telegram/webhook/', telegram_webhook, name='telegram_webhook'),
+    # where prometheus looks by default
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
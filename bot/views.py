@@ -1,20 +1,28 @@
-import requests
+import hashlib
+import hmac
+import json
+import logging
 
+from asgiref.sync import sync_to_async
 from django.utils.dateformat import format as dateformat
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from django.conf import settings
-from django.shortcuts import get_object_or_404, render
-from django.db import transaction
-from .models import Order, OrderItem, Reciept
+from django.shortcuts import render
+from .models import Order
+from . import metrics, order_details, payments, paystack
 
 # telebot imports
-import telebot
+from telebot.types import Update
 
+# the same bot instance the handlers in bot.py are registered on
+from .bot import bot
 
 
-# Initialize the bot with the token
-bot = telebot.TeleBot(settings.TOKEN)
+logger = logging.getLogger(__name__)
+
 website_link = settings.WEBSITE_LINK
 
 
@@ -23,25 +31,96 @@ def home(request):
 
 
 
+def order_details_etag(request, order_id):
+    details = order_details.get_order_details(order_id)
+    return details and details["etag"]
+
+
+def order_details_last_modified(request, order_id):
+    details = order_details.get_order_details(order_id)
+    return details and details["last_modified"]
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=order_details_etag, last_modified_func=order_details_last_modified)
 def get_order_details(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    items = OrderItem.objects.filter(order=order).select_related("product")
-    data = {
-        "delivery_date": f"{order.delivery_date}",
-        "id": order.id,
-        "full_name": order.full_name,
-        "hall": order.hall,
-        "room_no": order.room_no,
-        "items": [{"product": {"title": item.product.title}, "quantity": item.quantity} for item in items],
-    }
-    return JsonResponse(data)
+    """
+    Serves an order's details from the cache. Browsers revalidate on every load and get a 304
+    while the order hasn't changed, neither costs a database query once the details are cached.
+    """
+    details = order_details.get_order_details(order_id)
+    if details is None:
+        raise Http404("No Order matches the given query.")
+    return HttpResponse(details["body"], content_type="application/json")
 
 
 
 
 
 @csrf_exempt
-def paystack_callback(request):
+@require_POST
+def telegram_webhook(request):
+    """
+    Receives updates pushed by telegram and feeds them to the bot's handlers.
+    """
+    # without a secret anyone could post updates here, so none are taken until one is set
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret or not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+        return HttpResponseForbidden()
+
+    try:
+        update = Update.de_json(request.body.decode("utf-8"))
+    except (ValueError, KeyError, TypeError):
+        # TypeError for json that isn't an object, e.g. [] or 1
+        return JsonResponse({"status": "error", "message": "Invalid update."}, status=400)
+
+    bot.process_new_updates([update])
+    # telegram only needs a 2xx, anything else makes it retry the same update
+    return HttpResponse()
+
+
+
+def prometheus_metrics(request):
+    """
+    Serves this process's metrics for prometheus to scrape, behind a bearer token when METRICS_TOKEN is set.
+    """
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponseForbidden()
+
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+
+def payment_success_context(order_id, trxref, charge):
+    """
+    Marks the order payed and loads what the success page shows, from the one order mark_order_paid loaded.
+    """
+    order = payments.mark_order_paid(order_id, trxref, charge)
+    items = list(order.orderitem_set.all())
+    return {
+        "order": order,
+        "items": items,
+        # what the receipt pdf is drawn from
+        "receipt": {
+            "id": order.id,
+            "full_name": order.full_name,
+            "hall": order.hall,
+            "room_no": order.room_no,
+            "delivery_date": f"{order.delivery_date}" if order.delivery_date else None,
+            "items": [{"product": {"title": item.product.title}, "quantity": item.quantity} for item in items],
+        },
+    }
+
+
+
+@csrf_exempt
+async def paystack_callback(request):
+    """
+    Verifies the payment paystack redirected the user back with.
+
+    The view is async so waiting on paystack doesn't hold up a worker, the database work runs in a thread.
+    """
     if request.method == "GET":
         payment_reference = request.GET.get("reference")
         trxref = request.GET.get("trxref")
@@ -50,40 +129,33 @@ def paystack_callback(request):
         if not payment_reference or not trxref:
             return JsonResponse({"status": "error", "message": "Missing reference or trxref."}, status=400)
 
-        headers = {
-            "Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}",
-        }
-        verification_url = f"https://api.paystack.co/transaction/verify/{trxref}"
-        response = requests.get(verification_url, headers=headers)
-
-        payment_data = response.json()
+        try:
+            payment_data = await paystack.averify_transaction(trxref)
+        except paystack.PaystackError:
+            return render(
+                request,
+                "bot/payment_failed.html",
+                {"error_message": "We couldn't confirm your payment with Paystack, please refresh this page.", "reference": payment_reference},
+            )
 
         if payment_data["status"] and payment_data["data"]["status"] == "success":
             try:
-                order = Order.objects.get(id=order_id)
-                with transaction.atomic():
-                    order.payed = True  # modify payment status
-                    order.save()
-
-                    reciept = Reciept.objects.get_or_create(
-                        trxref = trxref,
-                        order = order,
-                        reference = payment_reference
-                    )
-
+                context = await sync_to_async(payment_success_context)(order_id, trxref, payment_data["data"])
+            except payments.PaymentMismatch as e:
+                logger.warning("Rejected paystack callback for order %s: %s", order_id, e)
                 return render(
                     request,
-                    "bot/payment_success.html",
+                    "bot/payment_failed.html",
                     {
-                        "order_id": order.id,
-                        "full_name": order.full_name,
-                        "hall": order.hall,
-                        "room_no": order.room_no,
-                        "items": order.orderitem_set.select_related("product"),
+                        "error_message": "This payment isn't for this order's current total. We've kept a record of it, "
+                        "contact us with the reference below to have it refunded or applied to your order.",
+                        "reference": payment_reference,
                     },
+                    status=400,
                 )
-            except Order.DoesNotExist:
+            except (Order.DoesNotExist, ValueError):
                 return JsonResponse({"status": "error", "message": "Order not found."})
+            return render(request, "bot/payment_success.html", context)
         else:
             error_message = payment_data.get("message", "Unknown error occurred.")
             return render(
@@ -92,4 +164,59 @@ def paystack_callback(request):
                 {"error_message": error_message, "reference": payment_reference},
             )
 
-    return JsonResponse({"status": "error", "message": "Invalid request."}, status=400)
\ No newline at end of file
+    return JsonResponse({"status": "error", "message": "Invalid request."}, status=400)
+
+
+
+def paystack_signature_is_valid(request):
+    """
+    Checks the X-Paystack-Signature header, a HMAC SHA512 of the body signed with our secret key.
+    """
+    signature = request.headers.get("X-Paystack-Signature", "")
+    expected = hmac.new(settings.PAYSTACK_SECRET_KEY.encode(), request.body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+def order_for_charge(charge):
+    """
+    Finds the order a successful paystack charge paid for, by the reference of its checkout link
+    or the order_id sent along as metadata.
+    """
+    order = Order.objects.filter(payment_reference=charge.get("reference")).first()
+    if order:
+        return order
+
+    order_id = payments.charge_order_id(charge)
+    return order_id and Order.objects.filter(id=order_id).first()
+
+
+
+@csrf_exempt
+@require_POST
+def paystack_webhook(request):
+    """
+    Receives payment events from paystack's servers, a successful charge marks its order payed.
+    """
+    if not paystack_signature_is_valid(request):
+        return HttpResponseForbidden()
+
+    try:
+        event = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "Invalid payload."}, status=400)
+
+    charge = event.get("data") or {}
+    if event.get("event") != "charge.success" or charge.get("status") != "success":
+        # paystack sends other events too, they need nothing from us
+        return HttpResponse()
+
+    order = order_for_charge(charge)
+    if order is None:
+        return JsonResponse({"status": "error", "message": "Order not found."}, status=404)
+
+    try:
+        payments.mark_order_paid(order.id, charge["reference"], charge)
+    except payments.PaymentMismatch as e:
+        logger.warning("Rejected paystack charge %s: %s", charge.get("reference"), e)
+        return JsonResponse({"status": "error", "message": "Charge doesn't match the order."}, status=400)
+    return HttpResponse()
@@ -35,6 +35,51 @@ PAYSTACK_SECRET_KEY = os.getenv("PAYSTACK_SECRET_KEY")
 WEBSITE_LINK = os.getenv("WEBSITE_LINK")
 WEBSITE_NAME = os.getenv("WEBSITE_NAME")
 
+# shared secret telegram echoes back in the X-Telegram-Bot-Api-Secret-Token header of webhook calls
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+# number of threads running bot handlers, updates from the same chat are still handled in order
+BOT_WORKER_THREADS = int(os.getenv("BOT_WORKER_THREADS", 4))
+
+# outgoing messages per second, across all chats and per chat (with bursts of TELEGRAM_CHAT_BURST)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 3))
+
+# where half finished orders and the step they're at are kept, "memory" or "database" (shared by every bot process)
+BOT_STATE_STORE = os.getenv("BOT_STATE_STORE", "memory")
+BOT_STATE_TTL = int(os.getenv("BOT_STATE_TTL", 60 * 60))  # seconds
+BOT_STATE_MAX_SIZE = int(os.getenv("BOT_STATE_MAX_SIZE", 10000))
+
+# halls the bot delivers to, shown as the hall menu in this order. a comma separated list in the environment
+BOT_HALLS = [hall.strip() for hall in os.getenv("BOT_HALLS", "Paul,Joseph,Peter,John,Daniel,Mary,Lydia,Deborah,Dorcas,Esther").split(",") if hall.strip()]
+
+# the product catalogue is cached in each process for CATALOGUE_CACHE_TTL seconds and dropped when a product
+# is edited in that process. point CATALOGUE_CACHE at a shared cache alias to have admin edits show up in the bot at once,
+# it's still only kept there for CATALOGUE_CACHE_TTL seconds
+CATALOGUE_CACHE = os.getenv("CATALOGUE_CACHE")
+CATALOGUE_CACHE_TTL = int(os.getenv("CATALOGUE_CACHE_TTL", 5 * 60))  # seconds
+
+# /api/orders/<id>/ payloads are cached in this cache alias and dropped when the order changes. with the default
+# per process cache, changes made by another process (e.g. the bot worker) show up after ORDER_DETAILS_CACHE_TTL seconds
+ORDER_DETAILS_CACHE = os.getenv("ORDER_DETAILS_CACHE", "default")
+ORDER_DETAILS_CACHE_TTL = int(os.getenv("ORDER_DETAILS_CACHE_TTL", 5 * 60))  # seconds
+
+# /metrics serves the metrics of the process it's asked, in webhook mode that's where updates are handled. when set,
+# scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# run_bot prints a summary of its metrics this often, 0 turns it off
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 60))  # seconds
+
+# paystack api client, see bot/paystack.py
+PAYSTACK_BASE_URL = os.getenv("PAYSTACK_BASE_URL", "https://api.paystack.co")
+PAYSTACK_CONNECT_TIMEOUT = float(os.getenv("PAYSTACK_CONNECT_TIMEOUT", 3.05))  # seconds
+PAYSTACK_READ_TIMEOUT = float(os.getenv("PAYSTACK_READ_TIMEOUT", 10))  # seconds
+PAYSTACK_MAX_RETRIES = int(os.getenv("PAYSTACK_MAX_RETRIES", 3))
+PAYSTACK_POOL_SIZE = int(os.getenv("PAYSTACK_POOL_SIZE", 10))
+# how long a checkout link is reused before a new paystack transaction is started
+PAYSTACK_LINK_TTL = int(os.getenv("PAYSTACK_LINK_TTL", 30 * 60))  # seconds
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 if WEBSITE_LINK.startswith("http:"):